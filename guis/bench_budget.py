@@ -0,0 +1,113 @@
+import argparse
+import os
+import time
+from dataclasses import replace
+
+import cv2
+
+from keypoint_budget import apply_budget
+from reference_index import ReferenceIndex
+from sift2 import match_batch
+from sign_regions import find_sign_contours, roi_bounds
+
+
+def with_budget(index, budget):
+    """Copy of a full index with every reference cut down to `budget` keypoints."""
+    budgeted = ReferenceIndex(index.repo_path, sift=index.sift, masked=index.masked, budget=budget)
+    for entry in index:
+        keypoints, descriptors = apply_budget(entry.keypoints, entry.descriptors, budget)
+        budgeted.entries[entry.file_name] = replace(
+            entry, keypoints=keypoints, descriptors=descriptors
+        )
+    return budgeted
+
+
+def distort(roi, angle=8, scale=0.8):
+    height, width = roi.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, scale)
+    warped = cv2.warpAffine(roi, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE)
+    return cv2.GaussianBlur(warped, (3, 3), 0)
+
+
+def synthetic_queries(index):
+    """One labelled query per reference: its largest sign, rotated, scaled and blurred."""
+    queries = []
+    for entry in index:
+        image = index.load_color(entry.file_name)
+        found = find_sign_contours(image)
+        if not found:
+            continue
+        contour = max((c for _, c in found), key=cv2.contourArea)
+        x1, y1, x2, y2 = roi_bounds(image, contour)
+        queries.append((entry.file_name, distort(image[y1:y2, x1:x2])))
+    return queries
+
+
+def extract(index, images):
+    descriptors = []
+    for img in images:
+        _, des = index.sift.detectAndCompute(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), None)
+        descriptors.append((des, None))
+    return descriptors
+
+
+def run(repo_path, budgets, inputs_path=None, min_matches=10):
+    full = ReferenceIndex(repo_path).build()
+
+    labelled = synthetic_queries(full)
+    labelled_queries = extract(full, [img for _, img in labelled])
+
+    real_queries = []
+    if inputs_path:
+        files = sorted(f for f in os.listdir(inputs_path) if f.lower().endswith((".png", ".jpg", ".jpeg")))
+        real_queries = extract(full, [cv2.imread(os.path.join(inputs_path, f)) for f in files])
+    baseline = [r[0] for r in match_batch(full, real_queries, min_matches)] if real_queries else []
+
+    rows = []
+    for budget in budgets:
+        index = full if budget is None else with_budget(full, budget)
+
+        start = time.perf_counter()
+        results = match_batch(index, labelled_queries, min_matches)
+        elapsed = time.perf_counter() - start
+        correct = sum(result[0] == label for result, (label, _) in zip(results, labelled))
+
+        agreement = None
+        if real_queries:
+            answers = [r[0] for r in match_batch(index, real_queries, min_matches)]
+            agreement = sum(a == b for a, b in zip(answers, baseline)) / len(baseline)
+
+        row = dict(index.stats())
+        row.update(
+            {
+                "budget": budget or "none",
+                "accuracy": correct / len(labelled) if labelled else 0.0,
+                "agreement": agreement,
+                "ms_per_query": elapsed * 1000 / max(1, len(labelled)),
+            }
+        )
+        rows.append(row)
+    return rows, len(labelled)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Index size and recognition accuracy at several keypoint budgets."
+    )
+    parser.add_argument("--repo", default="images/")
+    parser.add_argument("--inputs", default="inputs/", help="real queries, compared to the unbudgeted answer")
+    parser.add_argument("--budgets", default="none,2000,1000,500,250,100")
+    args = parser.parse_args()
+
+    budgets = [None if b == "none" else int(b) for b in args.budgets.split(",")]
+    inputs_path = args.inputs if os.path.isdir(args.inputs) else None
+    rows, count = run(args.repo, budgets, inputs_path)
+
+    print(f"{count} synthetic queries (largest sign of each reference, rotated/scaled/blurred)")
+    print(f"{'budget':>7} {'keypoints':>10} {'max/ref':>8} {'MB':>7} {'accuracy':>9} {'agree':>6} {'ms/query':>9}")
+    for row in rows:
+        agreement = f"{row['agreement']:.0%}" if row["agreement"] is not None else "-"
+        print(
+            f"{row['budget']:>7} {row['keypoints']:>10} {row['max_keypoints']:>8} "
+            f"{row['descriptor_mb']:>7} {row['accuracy']:>9.0%} {agreement:>6} {row['ms_per_query']:>9.1f}"
+        )
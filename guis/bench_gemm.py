@@ -0,0 +1,91 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+from bench_budget import extract, synthetic_queries
+from gemm_matching import GemmMatcher, knn2_gemm
+from reference_index import ReferenceIndex
+from sift2 import match_batch
+
+
+def match_pairs(good_matches):
+    if not good_matches:
+        return []
+    return sorted((m[0].queryIdx, m[0].trainIdx) for m in good_matches)
+
+
+def check_knn(index, queries, bf):
+    """Compare knn2_gemm to knnMatch(k=2) neighbour by neighbour."""
+    mismatches = 0
+    total = 0
+    for descriptors_input, _ in queries:
+        if descriptors_input is None:
+            continue
+        for entry in index:
+            expected = bf.knnMatch(descriptors_input, entry.descriptors, k=2)
+            _, indices = knn2_gemm(descriptors_input, entry.descriptors)
+            for row, pair in enumerate(expected):
+                total += 1
+                if [m.trainIdx for m in pair] != list(indices[row, : len(pair)]):
+                    mismatches += 1
+    return mismatches, total
+
+
+def run(repo_path, inputs_path=None, knn_queries=3):
+    index = ReferenceIndex(repo_path).build()
+
+    images = [img for _, img in synthetic_queries(index)]
+    if inputs_path:
+        for f in sorted(os.listdir(inputs_path)):
+            if f.lower().endswith((".png", ".jpg", ".jpeg")):
+                images.append(cv2.imread(os.path.join(inputs_path, f)))
+    queries = extract(index, images)
+
+    start = time.perf_counter()
+    expected = match_batch(index, queries)
+    bf_seconds = time.perf_counter() - start
+
+    matcher = GemmMatcher(index)
+    start = time.perf_counter()
+    actual = matcher.match(queries)
+    gemm_seconds = time.perf_counter() - start
+
+    differences = []
+    for q, (a, b) in enumerate(zip(expected, actual)):
+        if a[0] != b[0] or abs(a[1] - b[1]) > 1e-9 or match_pairs(a[3]) != match_pairs(b[3]):
+            differences.append((q, a[0], a[1], b[0], b[1]))
+
+    knn_mismatches, knn_total = check_knn(index, queries[:knn_queries], cv2.BFMatcher())
+    return {
+        "queries": len(queries),
+        "bf_seconds": bf_seconds,
+        "gemm_seconds": gemm_seconds,
+        "differences": differences,
+        "knn_mismatches": knn_mismatches,
+        "knn_total": knn_total,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check GemmMatcher against knnMatch + ratio test and time both."
+    )
+    parser.add_argument("--repo", default="images/")
+    parser.add_argument("--inputs", default="inputs/")
+    args = parser.parse_args()
+
+    report = run(args.repo, args.inputs if os.path.isdir(args.inputs) else None)
+    print(
+        f"{report['queries']} queries: knnMatch {report['bf_seconds']:.2f} s, "
+        f"GEMM {report['gemm_seconds']:.2f} s "
+        f"({report['bf_seconds'] / report['gemm_seconds']:.1f}x)"
+    )
+    print(f"nearest-neighbour mismatches: {report['knn_mismatches']} of {report['knn_total']}")
+    for q, expected, expected_score, actual, actual_score in report["differences"]:
+        print(f"  query {q}: knnMatch {expected} ({expected_score:.2f}) vs GEMM {actual} ({actual_score:.2f})")
+    if report["differences"] or report["knn_mismatches"]:
+        sys.exit(1)
+    print("results identical")
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+# Every entry point is imported in a fresh interpreter so that nothing is
+# already cached in sys.modules. The budgets are in milliseconds and in
+# modules newly loaded by the import (cv2 and numpy alone are about 180).
+# With --allow-missing a target is skipped when one of its "optional"
+# packages is not installed; any other import error fails the run.
+TARGETS = {
+    "sift": {"kind": "cli", "budget_ms": 400, "max_modules": 250, "forbidden": ["matplotlib"]},
+    "sift2": {"kind": "cli", "budget_ms": 400, "max_modules": 250, "forbidden": ["matplotlib"]},
+    "gui": {
+        "kind": "gui", "budget_ms": 900, "max_modules": 350, "forbidden": ["matplotlib"],
+        "optional": ["PyQt6"],
+    },
+    "gui2": {
+        "kind": "gui", "budget_ms": 900, "max_modules": 350, "forbidden": ["matplotlib"],
+        "optional": ["PyQt6"],
+    },
+}
+
+PROBE = """
+import json, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = sorted(set(sys.modules) - before)
+print(json.dumps({{"elapsed": elapsed, "modules": loaded}}))
+"""
+
+
+def probe_import(module, cwd):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    return json.loads(result.stdout.strip().splitlines()[-1]), None
+
+
+def missing_package(error):
+    """Top-level package named by a ModuleNotFoundError line, or None."""
+    found = re.match(r"ModuleNotFoundError: No module named '([\w.]+)'", error or "")
+    return found.group(1).split(".")[0] if found else None
+
+
+def top_import_costs(module, cwd, count=5):
+    # -X importtime writes "self | cumulative | name" lines to stderr
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+    costs = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        costs.append((int(self_us), name.strip()))
+    return sorted(costs, reverse=True)[:count]
+
+
+def run_benchmark(repeats=5, budget_scale=1.0, cwd=None, allow_missing=False):
+    cwd = cwd or os.path.dirname(os.path.abspath(__file__))
+    report = {}
+
+    for module, spec in TARGETS.items():
+        timings = []
+        modules = []
+        error = None
+        for _ in range(repeats):
+            sample, error = probe_import(module, cwd)
+            if sample is None:
+                break
+            timings.append(sample["elapsed"] * 1000)
+            modules = sample["modules"]
+
+        if error:
+            # Only a missing third-party package may be skipped, and only on request
+            skippable = allow_missing and missing_package(error) in spec.get("optional", [])
+            report[module] = {"status": "skipped" if skippable else "error", "reason": error}
+            continue
+
+        budget_ms = spec["budget_ms"] * budget_scale
+        median_ms = statistics.median(timings)
+        heavy = [
+            name
+            for name in spec["forbidden"]
+            if any(m == name or m.startswith(name + ".") for m in modules)
+        ]
+        within = median_ms <= budget_ms and len(modules) <= spec["max_modules"]
+        report[module] = {
+            "status": "ok" if within and not heavy else "over",
+            "kind": spec["kind"],
+            "median_ms": round(median_ms, 1),
+            "budget_ms": budget_ms,
+            "modules_loaded": len(modules),
+            "max_modules": spec["max_modules"],
+            "forbidden_loaded": heavy,
+            "top_imports": top_import_costs(module, cwd),
+        }
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure matcher and GUI startup time.")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--budget-scale",
+        type=float,
+        default=1.0,
+        help="multiply every budget (e.g. 2.0 on slow CI machines)",
+    )
+    parser.add_argument("--json", action="store_true", help="print the raw report")
+    parser.add_argument(
+        "--allow-missing",
+        action="store_true",
+        help="skip targets whose third-party dependencies (e.g. PyQt6) are not installed",
+    )
+    args = parser.parse_args()
+
+    report = run_benchmark(args.repeats, args.budget_scale, allow_missing=args.allow_missing)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for module, entry in report.items():
+            if entry["status"] in ("skipped", "error"):
+                print(f"{module}: {entry['status']} ({entry['reason']})")
+                continue
+            print(
+                f"{module} [{entry['kind']}]: {entry['median_ms']} ms "
+                f"(budget {entry['budget_ms']} ms), {entry['modules_loaded']} modules "
+                f"(budget {entry['max_modules']}), status: {entry['status']}"
+            )
+            if entry["forbidden_loaded"]:
+                print(f"  heavy imports: {', '.join(entry['forbidden_loaded'])}")
+            for self_us, name in entry["top_imports"]:
+                print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    sys.exit(1 if any(e["status"] in ("over", "error") for e in report.values()) else 0)
@@ -0,0 +1,281 @@
+import argparse
+import bisect
+import heapq
+import json
+import os
+import resource
+
+import cv2
+import numpy as np
+
+from reference_index import ReferenceIndex
+from sift2 import cluster_score_points, stack_queries
+
+DESCRIPTORS_FILE = "descriptors.f32"
+POINTS_FILE = "points.f32"
+MANIFEST_FILE = "manifest.json"
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def build_store(repo_path, store_path, masked=False, budget=None):
+    """Write the features of a repository as flat files that can be streamed.
+
+    Descriptors and keypoint coordinates are appended one reference at a
+    time, so building the store never holds more than one reference either.
+    """
+    index = ReferenceIndex(repo_path, masked=masked, budget=budget)
+    os.makedirs(store_path, exist_ok=True)
+    references = []
+    rows = 0
+    dim = 128
+
+    with open(os.path.join(store_path, DESCRIPTORS_FILE), "wb") as descriptors_file, open(
+        os.path.join(store_path, POINTS_FILE), "wb"
+    ) as points_file:
+        for file_name in index.list_images():
+            img_repo_color = cv2.imread(os.path.join(repo_path, file_name))
+            if img_repo_color is None:
+                continue
+            entry = index.compute(img_repo_color, file_name)
+            if entry is None:
+                continue
+
+            descriptors = np.ascontiguousarray(entry.descriptors, dtype=np.float32)
+            dim = descriptors.shape[1]
+            descriptors.tofile(descriptors_file)
+            np.float32([kp.pt for kp in entry.keypoints]).tofile(points_file)
+            references.append(
+                {
+                    "file_name": file_name,
+                    "start": rows,
+                    "count": len(descriptors),
+                    "shape": list(entry.shape),
+                }
+            )
+            rows += len(descriptors)
+
+    manifest_path = os.path.join(store_path, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump({"rows": rows, "dim": dim, "references": references}, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return len(references), rows
+
+
+class ChunkedMatcher:
+    """Matches queries against a feature store without loading it.
+
+    Reference descriptors are read in chunks of at most chunk_rows rows,
+    sized so a chunk fits in max_memory_mb. For every query descriptor the
+    two nearest neighbours inside the current reference are kept as it
+    streams past (a reference may span several chunks); once a reference is
+    complete it is scored exactly like match_batch does and offered to a
+    per-query top-k.
+
+    RSS is sampled while each chunk is still live. If reading and matching
+    one chunk grew the process by more than the ceiling, the next chunk is
+    halved; if it used less than half, chunks grow back towards the planned
+    size. Chunks never go below min_chunk_rows, where per-call overhead
+    would dominate, so very small ceilings are approximate.
+    """
+
+    def __init__(self, store_path, max_memory_mb=64, top_k=5, min_chunk_rows=1024):
+        self.store_path = store_path
+        with open(os.path.join(store_path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        self.rows = manifest["rows"]
+        self.dim = manifest["dim"]
+        self.references = manifest["references"]
+        self.starts = [r["start"] for r in self.references]
+        self.max_memory_mb = max_memory_mb
+        self.top_k = top_k
+        self.min_chunk_rows = min_chunk_rows
+        self.bf = cv2.BFMatcher()
+        self.live_peak = 0.0
+
+    def chunk_rows(self, query_rows):
+        # Per query row: the running top-2 (distance + index), the merge
+        # temporaries (four of each) and the list of two DMatch objects
+        # knnMatch returns, about 200 bytes in Python objects
+        state_bytes = query_rows * (6 * (4 + 8) + 200)
+        budget = max(0, self.max_memory_mb * 2**20 - state_bytes)
+        return max(self.min_chunk_rows, int(budget // (self.dim * 4 + 8)))
+
+    def _read_rows(self, f, start, stop, width):
+        f.seek(start * width * 4)
+        return np.fromfile(f, dtype=np.float32, count=(stop - start) * width).reshape(-1, width)
+
+    def _knn_arrays(self, stacked, segment):
+        distances = np.full((len(stacked), 2), np.inf, dtype=np.float32)
+        indices = np.full((len(stacked), 2), -1, dtype=np.int64)
+        matches = self.bf.knnMatch(stacked, segment, k=2)
+        # The DMatch lists are the largest temporary, sample while they exist
+        self.live_peak = max(self.live_peak, current_rss_mb())
+        for row, pair in enumerate(matches):
+            for j, m in enumerate(pair):
+                distances[row, j] = m.distance
+                indices[row, j] = m.trainIdx
+        return distances, indices
+
+    def match(self, queries, min_matches=10):
+        """queries as for match_batch; returns (results, report).
+
+        results holds one top-k list per query, each a list of
+        (file_name, score, good_match_count) tuples, best first.
+        """
+        stacked, offsets = stack_queries(queries, np.float32)
+        tops = [[] for _ in queries]
+        report = {"chunks": 0, "shrinks": 0, "rss_before_mb": round(current_rss_mb(), 1)}
+        if stacked is None or not self.references:
+            return [[] for _ in queries], report
+
+        baseline = current_rss_mb()
+        planned_rows = chunk_rows = self.chunk_rows(len(stacked))
+        report["chunk_rows"] = chunk_rows
+        report["grows"] = 0
+        streaming_peak = baseline
+
+        best_d = best_i = None
+        with open(os.path.join(self.store_path, DESCRIPTORS_FILE), "rb") as descriptors_file, open(
+            os.path.join(self.store_path, POINTS_FILE), "rb"
+        ) as points_file:
+            position = 0
+            while position < self.rows:
+                before = self.live_peak = current_rss_mb()
+                stop = min(position + chunk_rows, self.rows)
+                chunk = self._read_rows(descriptors_file, position, stop, self.dim)
+                report["chunks"] += 1
+
+                # Walk the references overlapping [position, stop)
+                ref = bisect.bisect_right(self.starts, position) - 1
+                while ref < len(self.references) and self.references[ref]["start"] < stop:
+                    reference = self.references[ref]
+                    ref_start = reference["start"]
+                    ref_stop = ref_start + reference["count"]
+                    seg_start, seg_stop = max(ref_start, position), min(ref_stop, stop)
+
+                    distances, indices = self._knn_arrays(
+                        stacked, chunk[seg_start - position:seg_stop - position]
+                    )
+                    indices[indices >= 0] += seg_start - ref_start
+                    if seg_start == ref_start:
+                        best_d, best_i = distances, indices
+                    else:
+                        # Merge with the neighbours found in earlier chunks
+                        all_d = np.hstack([best_d, distances])
+                        all_i = np.hstack([best_i, indices])
+                        order = np.argsort(all_d, axis=1, kind="stable")[:, :2]
+                        best_d = np.take_along_axis(all_d, order, axis=1)
+                        best_i = np.take_along_axis(all_i, order, axis=1)
+
+                    if seg_stop == ref_stop:
+                        points = self._read_rows(points_file, ref_start, ref_stop, 2)
+                        self._score_reference(
+                            reference, points, best_d, best_i, queries, offsets, tops, min_matches
+                        )
+                    ref += 1
+
+                # Measured with the chunk and its match results still alive
+                live = max(self.live_peak, current_rss_mb())
+                streaming_peak = max(streaming_peak, live)
+                growth = live - before
+                position = stop
+                del chunk
+
+                if growth > self.max_memory_mb and chunk_rows > self.min_chunk_rows:
+                    chunk_rows = max(self.min_chunk_rows, chunk_rows // 2)
+                    report["shrinks"] += 1
+                elif growth < self.max_memory_mb / 2 and chunk_rows < planned_rows:
+                    chunk_rows = min(planned_rows, chunk_rows * 2)
+                    report["grows"] += 1
+
+        report["streaming_peak_rss_mb"] = round(streaming_peak, 1)
+        report["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        results = [
+            [(name, score, good) for score, _, name, good in sorted(top, reverse=True)]
+            for top in tops
+        ]
+        return results, report
+
+    def _score_reference(self, reference, points, best_d, best_i, queries, offsets, tops,
+                         min_matches):
+        for q, (descriptors_input, exclude) in enumerate(queries):
+            if descriptors_input is None or reference["file_name"] == exclude:
+                continue
+            rows = slice(offsets[q], offsets[q] + len(descriptors_input))
+            d, i = best_d[rows], best_i[rows]
+
+            # Lowe's ratio test, as in sift2.ratio_test
+            good = np.isfinite(d[:, 1]) & (d[:, 0] < 0.75 * d[:, 1])
+            good_count = int(np.count_nonzero(good))
+            if good_count < min_matches:
+                continue
+
+            score, clustering_ratio = cluster_score_points(points[i[good, 0]], reference["shape"])
+            if clustering_ratio <= 0.6:
+                continue
+
+            item = (float(score), -len(tops[q]), reference["file_name"], good_count)
+            if len(tops[q]) < self.top_k:
+                heapq.heappush(tops[q], item)
+            elif item > tops[q][0]:
+                heapq.heapreplace(tops[q], item)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bounded-memory matching against a feature store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="write a feature store for a repository")
+    build_parser.add_argument("--repo", default="images/")
+    build_parser.add_argument("--store", default="feature_store/")
+    build_parser.add_argument("--mask", action="store_true")
+    build_parser.add_argument("--budget", type=int)
+
+    match_parser = commands.add_parser("match", help="match images against a feature store")
+    match_parser.add_argument("images", nargs="+")
+    match_parser.add_argument("--store", default="feature_store/")
+    match_parser.add_argument("--max-memory-mb", type=float, default=64)
+    match_parser.add_argument("--top-k", type=int, default=5)
+    match_parser.add_argument("--min-matches", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count, rows = build_store(args.repo, args.store, args.mask, args.budget)
+        print(f"Stored {count} references ({rows} descriptors) in {args.store}")
+    else:
+        sift = cv2.SIFT_create()
+        queries = []
+        for path in args.images:
+            img = cv2.imread(path)
+            if img is None:
+                raise FileNotFoundError(f"Input image {path} not found.")
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            queries.append((sift.detectAndCompute(img, None)[1], os.path.basename(path)))
+
+        matcher = ChunkedMatcher(args.store, args.max_memory_mb, args.top_k)
+        results, report = matcher.match(queries, args.min_matches)
+        for path, top in zip(args.images, results):
+            print(f"{path}:")
+            for name, score, good in top:
+                print(f"  {name}: score {score:.2f} ({good} matches)")
+            if not top:
+                print("  no match")
+        print(
+            f"{report['chunks']} chunks of up to {report.get('chunk_rows', 0)} rows "
+            f"({report['shrinks']} shrinks, {report.get('grows', 0)} grows), "
+            f"streaming peak RSS {report.get('streaming_peak_rss_mb')} MB "
+            f"(baseline {report['rss_before_mb']} MB, process peak {report.get('peak_rss_mb')} MB)"
+        )
@@ -0,0 +1,161 @@
+import cv2
+import numpy as np
+
+from sift2 import cluster_score_points, stack_queries
+
+# Candidates kept from the float32 GEMM before exact re-ranking
+RERANK = 3
+
+
+def squared_norms(descriptors):
+    return np.einsum("ij,ij->i", descriptors, descriptors)
+
+
+def top2_rerank(query, train, d2):
+    """Two nearest train rows per query row, given approximate squared distances d2.
+
+    The expansion |a|^2 + |b|^2 - 2ab loses precision in float32, so the best
+    RERANK candidates of every row are re-ranked with directly computed
+    distances, the way BFMatcher(NORM_L2) computes them. Returns
+    (distances, indices) of shape (n, 2), with inf/-1 where train has fewer
+    than two rows.
+    """
+    n, m = d2.shape
+    distances = np.full((n, 2), np.inf, dtype=np.float32)
+    indices = np.full((n, 2), -1, dtype=np.int64)
+    if n == 0 or m == 0:
+        return distances, indices
+
+    keep = min(RERANK, m)
+    if m > keep:
+        candidates = np.argpartition(d2, keep - 1, axis=1)[:, :keep]
+    else:
+        candidates = np.broadcast_to(np.arange(m), (n, m))
+
+    diff = query[:, None, :] - train[candidates]
+    exact = np.sqrt(np.einsum("ijk,ijk->ij", diff, diff))
+    order = np.argsort(exact, axis=1, kind="stable")[:, :2]
+
+    top = min(2, m)
+    distances[:, :top] = np.take_along_axis(exact, order, axis=1)
+    indices[:, :top] = np.take_along_axis(candidates, order, axis=1)
+    return distances, indices
+
+
+def squared_distances(query, train, query_norms, train_norms):
+    d2 = query @ train.T
+    d2 *= -2
+    d2 += query_norms[:, None]
+    d2 += train_norms[None, :]
+    return d2
+
+
+def knn2_gemm(query, train):
+    """Exact two nearest neighbours of every query row, from one matrix multiply."""
+    d2 = squared_distances(query, train, squared_norms(query), squared_norms(train))
+    return top2_rerank(query, train, d2)
+
+
+class GemmMatcher:
+    """Exact brute-force k-NN matching of many queries with BLAS.
+
+    Gives the same results as match_batch (knnMatch k=2, 0.75 ratio test,
+    clustering score) but replaces one knnMatch call per (query, reference)
+    pair with matrix multiplies over tiles of queries x references. Query
+    rows are processed tile_rows at a time and references are grouped into
+    column tiles of about tile_cols descriptors, which bounds the distance
+    block held in memory.
+    """
+
+    def __init__(self, index, tile_rows=512, tile_cols=4096):
+        self.index = index
+        self.tile_rows = tile_rows
+        self.tile_cols = tile_cols
+        self.trains = {}
+
+    def _train(self, entry):
+        cached = self.trains.get(entry.file_name)
+        if cached is None or cached[0] is not entry.descriptors:
+            train = np.ascontiguousarray(entry.descriptors, dtype=np.float32)
+            cached = (entry.descriptors, train, squared_norms(train))
+            self.trains[entry.file_name] = cached
+        return cached[1], cached[2]
+
+    def _column_tiles(self, entries):
+        tile, size = [], 0
+        for entry in entries:
+            if tile and size + len(entry.descriptors) > self.tile_cols:
+                yield tile
+                tile, size = [], 0
+            tile.append(entry)
+            size += len(entry.descriptors)
+        if tile:
+            yield tile
+
+    def knn(self, stacked, stacked_norms, entries):
+        """Per-reference top-2 of every stacked query row, as {file_name: (d, i)}."""
+        neighbours = {}
+        for tile in self._column_tiles(entries):
+            trains = [self._train(entry) for entry in tile]
+            train = np.vstack([t for t, _ in trains])
+            train_norms = np.concatenate([n for _, n in trains])
+            bounds = np.cumsum([0] + [len(t) for t, _ in trains])
+
+            results = {entry.file_name: [] for entry in tile}
+            for r0 in range(0, len(stacked), self.tile_rows):
+                rows = slice(r0, r0 + self.tile_rows)
+                block = squared_distances(stacked[rows], train, stacked_norms[rows], train_norms)
+                for entry, c0, c1 in zip(tile, bounds[:-1], bounds[1:]):
+                    results[entry.file_name].append(
+                        top2_rerank(stacked[rows], train[c0:c1], block[:, c0:c1])
+                    )
+            for name, parts in results.items():
+                neighbours[name] = (
+                    np.vstack([d for d, _ in parts]),
+                    np.vstack([i for _, i in parts]),
+                )
+        return neighbours
+
+    def match(self, queries, min_matches=10, entries=None, verbose=False, runner_up=None):
+        """Same inputs and outputs as sift2.match_batch."""
+        entries = list(self.index) if entries is None else list(entries)
+        results = [(None, 0, None, None) for _ in queries]
+
+        stacked, offsets = stack_queries(queries, np.float32)
+        if stacked is None or not entries:
+            return results
+        neighbours = self.knn(stacked, squared_norms(stacked), entries)
+
+        for entry in entries:
+            distances, indices = neighbours[entry.file_name]
+            for q, (descriptors_input, exclude) in enumerate(queries):
+                if descriptors_input is None or entry.file_name == exclude:
+                    continue
+                rows = slice(offsets[q], offsets[q] + len(descriptors_input))
+                d, i = distances[rows], indices[rows]
+
+                # Lowe's ratio test, as in sift2.ratio_test
+                good = np.flatnonzero(np.isfinite(d[:, 1]) & (d[:, 0] < 0.75 * d[:, 1]))
+                if len(good) < min_matches:
+                    continue
+
+                dst_pts = np.float32([entry.keypoints[t].pt for t in i[good, 0]])
+                score, clustering_ratio = cluster_score_points(dst_pts, entry.shape)
+                if verbose:
+                    print(
+                        f"{entry.file_name}: {len(good)} matches, clustering ratio: {clustering_ratio:.2f}, score: {score:.2f}"
+                    )
+
+                if clustering_ratio <= 0.6:
+                    continue
+                if score > results[q][1]:
+                    if runner_up is not None:
+                        runner_up[q] = results[q][1]
+                    good_matches = [
+                        [cv2.DMatch(int(g), int(i[g, 0]), float(d[g, 0]))] for g in good
+                    ]
+                    results[q] = (entry.file_name, score, entry.keypoints, good_matches)
+                elif runner_up is not None and score > runner_up[q]:
+                    runner_up[q] = score
+
+        return results
@@ -4,9 +4,11 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                             QHBoxLayout, QPushButton, QLabel, QFileDialog, 
                             QStackedWidget, QProgressBar)
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
-from PyQt6.QtGui import QPixmap, QImage
+from PyQt6.QtGui import QImageReader
 import cv2
 import numpy as np
+from image_loader import reduction_for, shared_loader
+from render_cache import array_to_pixmap
 
 class SIFTProcessor(QThread):
     finished = pyqtSignal(np.ndarray)
@@ -15,10 +17,13 @@ class SIFTProcessor(QThread):
     
     def __init__(self, image):
         super().__init__()
+        # An array, or the path of the image to decode on this thread
         self.image = image 
         
     def run(self):
         try:
+            if isinstance(self.image, str):
+                self.image = shared_loader.load(self.image)
             if not isinstance(self.image, np.ndarray):
                 raise ValueError("Input image is not a valid NumPy array")
 
@@ -41,9 +46,12 @@ class SIFTProcessor(QThread):
             image_files = [f for f in os.listdir(images_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
             total_files = len(image_files)
 
-            for index, filename in enumerate(image_files):
-                img2_path = os.path.join(images_dir, filename)
-                img2 = cv2.imread(img2_path, cv2.IMREAD_GRAYSCALE)
+            # Decoded references are kept by the shared loader, a second scan
+            # and the redraw below do not decode them again
+            image_paths = [os.path.join(images_dir, f) for f in image_files]
+            scan = shared_loader.scan(image_paths, lambda p: shared_loader.load(p, gray=True))
+            for index, (img2_path, img2) in enumerate(scan):
+                filename = os.path.basename(img2_path)
                 
                 if img2 is None:
                     print(f"Failed to load image: {filename}")
@@ -73,7 +81,7 @@ class SIFTProcessor(QThread):
 
             if best_match:
                 print(f"Best match: {best_match} with {max_good_matches} matches")
-                img2 = cv2.imread(os.path.join(images_dir, best_match), cv2.IMREAD_GRAYSCALE)
+                img2 = shared_loader.load(os.path.join(images_dir, best_match), gray=True)
                 kp2, des2 = sift.detectAndCompute(img2, None)
                 
                 matches = bf.knnMatch(des1, des2, k=2)
@@ -206,27 +214,21 @@ class DetectionPage(QWidget):
         
         if file_name:
             try:
-                self.current_image = cv2.imread(file_name)
-                if self.current_image is None:
-                    raise ValueError("Failed to load image")
-                
-                height, width = self.current_image.shape[:2]
-                bytes_per_line = 3 * width
-                qt_image = QImage(
-                    cv2.cvtColor(self.current_image, cv2.COLOR_BGR2RGB).data,
-                    width,
-                    height,
-                    bytes_per_line,
-                    QImage.Format.Format_RGB888
-                )
-                
-                pixmap = QPixmap.fromImage(qt_image)
-                scaled_pixmap = pixmap.scaled(
-                    self.image_preview.size(),
-                    Qt.AspectRatioMode.KeepAspectRatio,
-                    Qt.TransformationMode.SmoothTransformation
+                # Only the preview is decoded here, at the largest reduction
+                # that still covers the label (JPEGs decode at that size
+                # directly); the full image is decoded on the SIFT thread
+                header = QImageReader(file_name).size()
+                target = self.image_preview.size()
+                reduce = reduction_for(
+                    (header.height(), header.width()), max(target.width(), target.height())
                 )
+                preview = shared_loader.load(file_name, reduce=reduce)
+                if preview is None:
+                    raise ValueError("Failed to load image")
+                self.current_image = file_name
                 
+                # Downscale in OpenCV before converting, only preview pixels reach Qt
+                scaled_pixmap = array_to_pixmap(preview, target)
                 self.image_preview.setPixmap(scaled_pixmap)
                 self.process_image()
                 
@@ -242,7 +244,7 @@ class DetectionPage(QWidget):
             self.status_label.setStyleSheet("color: #2c3e50;")
             
             # Create and start SIFT processing thread
-            self.sift_thread = SIFTProcessor(self.current_image.copy())
+            self.sift_thread = SIFTProcessor(self.current_image)
             self.sift_thread.finished.connect(self.handle_processed_image)
             self.sift_thread.error.connect(self.handle_processing_error)
             self.sift_thread.progress.connect(self.update_progress_bar)
@@ -254,23 +256,8 @@ class DetectionPage(QWidget):
     
     def handle_processed_image(self, output_image):
         """Handle the processed image result"""
-        height, width = output_image.shape[:2]
-        bytes_per_line = 3 * width
-        qt_image = QImage(
-            cv2.cvtColor(output_image, cv2.COLOR_BGR2RGB).data,
-            width,
-            height,
-            bytes_per_line,
-            QImage.Format.Format_RGB888
-        )
-        
-        pixmap = QPixmap.fromImage(qt_image)
-        scaled_pixmap = pixmap.scaled(
-            self.output_preview.size(),
-            Qt.AspectRatioMode.KeepAspectRatio,
-            Qt.TransformationMode.SmoothTransformation
-        )
-        
+        # Downscale in OpenCV before converting, only preview pixels reach Qt
+        scaled_pixmap = array_to_pixmap(output_image, self.output_preview.size())
         self.output_preview.setPixmap(scaled_pixmap)
         self.progress_bar.setVisible(False)
         self.status_label.setText("Processing complete")
@@ -15,8 +15,9 @@ from PyQt6.QtCore import Qt, QRectF, QPointF
 from PyQt6.QtGui import QPixmap, QPainter, QPen, QColor, QImage
 import cv2
 import numpy as np
-import os
 from sift2 import find_best_match
+from sign_regions import rect_mask
+from render_cache import ViewportRenderer, array_to_qimage
 
 
 class ImageViewer(QWidget):
@@ -30,6 +31,7 @@ class ImageViewer(QWidget):
         self.crop_rect = None
         self.is_cropping = False
         self.crop_start = None
+        self.renderer = ViewportRenderer(self)
 
         # Enable mouse tracking for hover events
         self.setMouseTracking(True)
@@ -51,7 +53,6 @@ class ImageViewer(QWidget):
             return
 
         painter = QPainter(self)
-        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
 
         # Calculate scaled dimensions
         scaled_width = self.pixmap.width() * self.zoom_factor
@@ -61,11 +62,12 @@ class ImageViewer(QWidget):
         x = (self.width() - scaled_width) / 2 + self.offset.x()
         y = (self.height() - scaled_height) / 2 + self.offset.y()
 
-        # Draw image
-        painter.drawPixmap(
-            QRectF(x, y, scaled_width, scaled_height),
+        # Draw only the visible part of the image, from the per-zoom cache
+        self.renderer.paint(
+            painter,
             self.pixmap,
-            QRectF(0, 0, self.pixmap.width(), self.pixmap.height()),
+            QRectF(x, y, scaled_width, scaled_height),
+            QRectF(event.rect()),
         )
 
         # Draw crop rectangle if active
@@ -90,6 +92,7 @@ class ImageViewer(QWidget):
                 delta = event.pos() - self.pan_start
                 self.offset += QPointF(delta.x(), delta.y())
                 self.pan_start = event.pos()
+                self.renderer.interact()
             elif self.is_cropping and self.crop_start:
                 # Convert current position to QPointF
                 current_pos = QPointF(event.pos())
@@ -110,6 +113,7 @@ class ImageViewer(QWidget):
             self.zoom_factor *= zoom_out_factor
 
         self.zoom_factor = max(0.1, min(5.0, self.zoom_factor))
+        self.renderer.interact()
         self.update()
 
     def setCroppingMode(self, enabled):
@@ -118,7 +122,8 @@ class ImageViewer(QWidget):
             self.crop_rect = None
         self.update()
 
-    def getCroppedImage(self):
+    def getCropRect(self):
+        """Crop rectangle as (x, y, width, height) in image pixels, or None."""
         if not self.crop_rect or not self.image:
             return None
 
@@ -143,9 +148,9 @@ class ImageViewer(QWidget):
         width = min(width, self.image.width() - x)
         height = min(height, self.image.height() - y)
 
-        # Crop the image
-        cropped = self.image.copy(int(x), int(y), int(width), int(height))
-        return cropped
+        if width < 1 or height < 1:
+            return None
+        return int(x), int(y), int(width), int(height)
 
 
 class MainWindow(QMainWindow):
@@ -261,14 +266,14 @@ class MainWindow(QMainWindow):
             self.updateStatus("Please select a repository folder first")
             return
 
-        cropped_image = self.source_viewer.getCroppedImage()
-        if not cropped_image:
+        crop = self.source_viewer.getCropRect()
+        if not crop:
             self.updateStatus("Please crop the image first")
             return
 
-        # Save the cropped image temporarily
-        temp_path = "temp_cropped.png"
-        cropped_image.save(temp_path)
+        # Only keypoints inside the crop are matched, no cropped copy needed
+        image = self.source_viewer.image
+        mask = rect_mask((image.height(), image.width()), crop)
 
         try:
             self.updateStatus("Scanning... Please wait")
@@ -283,7 +288,7 @@ class MainWindow(QMainWindow):
                 img_input,
                 img_best,
             ) = find_best_match(
-                temp_path, self.repo_path, min_matches=10, ratio_thresh=0.7
+                self.current_image_path, self.repo_path, min_matches=10, ratio_thresh=0.7, mask=mask
             )
 
             if best_match:
@@ -298,19 +303,8 @@ class MainWindow(QMainWindow):
                     flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS,
                 )
 
-                # Convert to RGB for Qt display
-                img_matches_rgb = cv2.cvtColor(img_matches, cv2.COLOR_BGR2RGB)
-                height, width, channel = img_matches_rgb.shape
-                bytes_per_line = 3 * width
-
-                # Convert to QImage and QPixmap
-                q_img = QImage(
-                    img_matches_rgb.data,
-                    width,
-                    height,
-                    bytes_per_line,
-                    QImage.Format.Format_RGB888,
-                )
+                # Convert to QImage and QPixmap (Qt reads BGR directly)
+                q_img = array_to_qimage(img_matches)
                 pixmap = QPixmap.fromImage(q_img)
 
                 # Display in result viewer
@@ -327,10 +321,6 @@ class MainWindow(QMainWindow):
 
         except Exception as e:
             self.updateStatus(f"Error during scan: {str(e)}")
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
 
     def updateStatus(self, message):
         self.status_bar.showMessage(message)
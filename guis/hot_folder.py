@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from image_loader import ImageLoader, read_bytes
+from reference_index import FEATURE_CACHE_DIR, IMAGE_EXTENSIONS, ReferenceIndex, content_hash
+from sift2 import match_batch, result_record
+from sign_regions import sign_mask
+
+# Results log inside the watched folder, also the record of what is done
+STATE_FILE = ".hot_folder.jsonl"
+
+
+def load_records(log_path):
+    """Records already in the results log, oldest first.
+
+    A line is only complete once its newline is written; a partial last
+    line left by a crash is cut off so the next append starts clean.
+    """
+    records = []
+    if not os.path.exists(log_path):
+        return records
+    with open(log_path, "rb+") as f:
+        good_until = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if "file" not in record or "sha1" not in record:
+                break
+            records.append(record)
+            good_until += len(line)
+        f.truncate(good_until)
+    return records
+
+
+def write_sidecar(image_path, record):
+    path = os.path.splitext(image_path)[0] + ".json"
+    with open(path + ".tmp", "w") as f:
+        json.dump(record, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+class HotFolder:
+    """Recognizes every image dropped into a folder, once.
+
+    A poller lists the folder every `interval` seconds and queues new images
+    once they have not been modified for `settle` seconds (capture devices
+    may still be writing them) and two scans in a row found the same size
+    and mtime; a copy that keeps the source's mtime (cp -p) looks settled
+    from the start, but grows between scans while it is written. The queue
+    holds at most queue_size files: when a burst arrives faster than the
+    workers keep up, the poller waits on the full queue and the rest of the
+    burst stays on disk until there is room, so memory does not grow with
+    the backlog.
+
+    `workers` coroutines take files off the queue and run recognition on a
+    thread pool of the same size against one warm ReferenceIndex. Every
+    result is appended to the results log as one JSON line carrying the
+    file name and content hash of the image (and written as a sidecar
+    <image>.json with sidecars=True). The log is the commit point: files
+    already in it are skipped on start, so across restarts a file is
+    processed exactly once, and a file is only marked as seen once its
+    line is written, so one that failed is picked up again by a later scan.
+    A file that does not decode is counted as an error and not committed:
+    it is looked at again once its size or mtime changes, or after a restart.
+    A file with the same bytes as one recognized before, under another
+    name, is not matched again: it gets its own record and sidecar with
+    the earlier result and a "duplicate_of" naming the earlier file.
+    """
+
+    def __init__(self, folder, index, log_path=None, workers=2, queue_size=None, interval=1.0,
+                 settle=1.0, min_matches=10, masked=False, sidecars=False):
+        self.folder = folder
+        self.index = index
+        self.log_path = log_path or os.path.join(folder, STATE_FILE)
+        self.workers = workers
+        self.queue_size = queue_size or 2 * workers
+        self.interval = interval
+        self.settle = settle
+        self.min_matches = min_matches
+        self.masked = masked
+        self.sidecars = sidecars
+        # First record per content hash, and the (file, hash) pairs logged
+        self.processed = {}
+        self.done = set()
+        for record in load_records(self.log_path):
+            self.processed.setdefault(record["sha1"], record)
+            self.done.add((record["file"], record["sha1"]))
+        # Hashes in progress (set once their record is committed), file
+        # names queued or in progress, (size, mtime) of finished files and
+        # of files found by the last scan, not queued yet
+        self.claimed = {}
+        self.queued = set()
+        self.seen = {}
+        self.pending = {}
+        self.local = threading.local()
+        self.stats = {"processed": 0, "duplicates": 0, "skipped": 0, "errors": 0}
+
+    def _matchers(self):
+        # SIFT and BFMatcher objects are not shared between threads
+        if not hasattr(self.local, "sift"):
+            self.local.sift = cv2.SIFT_create()
+            self.local.bf = cv2.BFMatcher()
+        return self.local.sift, self.local.bf
+
+    def scan(self):
+        """New images that are no longer being written, oldest first.
+
+        Returns (path, signature) pairs and marks them as queued.
+        """
+        now = time.time()
+        ready = []
+        pending = {}
+        for entry in os.scandir(self.folder):
+            if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if entry.name in self.queued:
+                continue
+            stat = entry.stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self.seen.get(entry.name) == signature or now - stat.st_mtime < self.settle:
+                continue
+            if self.pending.get(entry.name) != signature:
+                # New or still changing, wait for the next scan
+                pending[entry.name] = signature
+                continue
+            self.queued.add(entry.name)
+            ready.append((stat.st_mtime, entry.path, signature))
+        self.pending = pending
+        return [(path, signature) for _, path, signature in sorted(ready)]
+
+    def recognize(self, path, data):
+        """Result record of the image bytes, or None if they do not decode."""
+        img_input_color = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img_input_color is None:
+            return None
+
+        sift, bf = self._matchers()
+        img_input = cv2.cvtColor(img_input_color, cv2.COLOR_BGR2GRAY)
+        mask = sign_mask(img_input_color) if self.masked else None
+        _, descriptors_input = sift.detectAndCompute(img_input, mask)
+        return result_record(
+            match_batch(self.index, [(descriptors_input, None)], self.min_matches, bf)[0]
+        )
+
+    def _append(self, record):
+        line = json.dumps(record) + "\n"
+        with open(self.log_path, "a") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def poll(self, queue, once=False):
+        scans = 0
+        while True:
+            for item in self.scan():
+                # Blocks while the workers are behind: back-pressure
+                await queue.put(item)
+            scans += 1
+            # A file is only queued by the second scan that finds it
+            if once and scans == 2:
+                break
+            await asyncio.sleep(self.interval)
+
+    async def work(self, queue, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            path, signature = await queue.get()
+            name = os.path.basename(path)
+            try:
+                if await self._process(loop, executor, path):
+                    # Only now, so a file that failed is retried by a later scan
+                    self.seen[name] = signature
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"{name}: {e}")
+            finally:
+                self.queued.discard(name)
+                queue.task_done()
+
+    async def _process(self, loop, executor, path):
+        """Recognize one file; returns True once it needs no further look."""
+        start = time.monotonic()
+        try:
+            data = await loop.run_in_executor(executor, read_bytes, path)
+        except FileNotFoundError:
+            # Removed before we got to it
+            return False
+        name = os.path.basename(path)
+        digest = content_hash(data)
+        if (name, digest) in self.done:
+            self.stats["skipped"] += 1
+            return True
+
+        # Workers share the event loop thread, check-and-claim cannot race.
+        # The same bytes in progress under another name: wait for that one
+        while digest in self.claimed:
+            await self.claimed[digest].wait()
+        earlier = self.processed.get(digest)
+        if earlier is not None:
+            record = {"file": name, "sha1": digest, "duplicate_of": earlier["file"]}
+            record.update(
+                (key, value)
+                for key, value in earlier.items()
+                if key not in ("file", "sha1", "latency_ms", "processed_at")
+            )
+            await self._commit(loop, executor, path, record, start)
+            self.stats["duplicates"] += 1
+            print(f"{name}: same as {earlier['file']}, {record.get('best_match')}")
+            return True
+
+        self.claimed[digest] = asyncio.Event()
+        try:
+            result = await loop.run_in_executor(executor, self.recognize, path, data)
+            if result is None:
+                # Not committed, possibly a partial write: retried once the
+                # file changes, or after a restart
+                self.stats["errors"] += 1
+                print(f"{name}: not a decodable image")
+                return True
+            record = {"file": name, "sha1": digest}
+            record.update(result)
+            await self._commit(loop, executor, path, record, start)
+            self.processed[digest] = record
+            self.stats["processed"] += 1
+            print(f"{name}: {record.get('best_match')} ({record['latency_ms']} ms)")
+            return True
+        finally:
+            self.claimed.pop(digest).set()
+
+    async def _commit(self, loop, executor, path, record, start):
+        record["latency_ms"] = round((time.monotonic() - start) * 1000, 2)
+        record["processed_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        # Sidecar first: if we stop before the log line, the file is
+        # processed again and the sidecar simply rewritten
+        if self.sidecars:
+            await loop.run_in_executor(executor, write_sidecar, path, record)
+        await loop.run_in_executor(executor, self._append, record)
+        self.done.add((record["file"], record["sha1"]))
+
+    async def run(self, once=False):
+        """Watch until cancelled; with once=True, process what is there and return."""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hot-folder") as executor:
+            workers = [asyncio.create_task(self.work(queue, executor)) for _ in range(self.workers)]
+            try:
+                await self.poll(queue, once)
+                await queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        return self.stats
+
+
+async def main(hot_folder, once):
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, task.cancel)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        return await hot_folder.run(once)
+    except asyncio.CancelledError:
+        return hot_folder.stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recognize images dropped into a folder.")
+    parser.add_argument("folder")
+    parser.add_argument("--repo", default="images/")
+    parser.add_argument("--log", help=f"results log (default: <folder>/{STATE_FILE})")
+    parser.add_argument("--sidecars", action="store_true", help="also write <image>.json next to each input")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, help="max files queued (default: 2 x workers)")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between folder scans")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds a file must be unchanged")
+    parser.add_argument("--min-matches", type=int, default=10)
+    parser.add_argument(
+        "--mask", action="store_true", help="extract features inside detected sign outlines only"
+    )
+    parser.add_argument("--budget", type=int, help="max keypoints kept per reference")
+    parser.add_argument("--once", action="store_true", help="process the current backlog and exit")
+    args = parser.parse_args()
+
+    index = ReferenceIndex(
+        args.repo,
+        cache_dir=os.path.join(args.repo, FEATURE_CACHE_DIR),
+        masked=args.mask,
+        budget=args.budget,
+        # Runs for days, references need not stay decoded after indexing
+        loader=ImageLoader(max_mb=0),
+    ).build()
+    print(f"Indexed {len(index)} reference images from {args.repo}, watching {args.folder}")
+
+    hot_folder = HotFolder(
+        args.folder,
+        index,
+        log_path=args.log,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        interval=args.interval,
+        settle=args.settle,
+        min_matches=args.min_matches,
+        masked=args.mask,
+        sidecars=args.sidecars,
+    )
+    stats = asyncio.run(main(hot_folder, args.once))
+    print(
+        f"{stats['processed']} processed, {stats['duplicates']} duplicates, "
+        f"{stats['skipped']} already done, {stats['errors']} errors"
+    )
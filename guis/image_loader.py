@@ -0,0 +1,165 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# imread flags decoding straight to 1/2, 1/4 or 1/8 scale. JPEG files are
+# decoded at the reduced size directly, other formats are resized on load.
+READ_FLAGS = {
+    (False, 1): cv2.IMREAD_COLOR,
+    (False, 2): cv2.IMREAD_REDUCED_COLOR_2,
+    (False, 4): cv2.IMREAD_REDUCED_COLOR_4,
+    (False, 8): cv2.IMREAD_REDUCED_COLOR_8,
+    (True, 1): cv2.IMREAD_GRAYSCALE,
+    (True, 2): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (True, 4): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (True, 8): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def reduction_for(shape, max_side):
+    """Largest supported reduction that keeps the long side at max_side or more."""
+    if not max_side:
+        return 1
+    for reduce in (8, 4, 2):
+        if max(shape[:2]) / reduce >= max_side:
+            return reduce
+    return 1
+
+
+class ImageLoader:
+    """Decoded images shared between callers, with background prefetch.
+
+    load() returns a cached array when the same file (same size and mtime)
+    was already decoded in the requested mode, so the best match re-read for
+    drawing and references re-read on every scan do not hit the decoder
+    again. Cached arrays are read-only, copy one before drawing on it. The
+    cache holds at most max_mb of pixels, least recently used first out;
+    max_mb=0 turns caching off and keeps only the prefetch.
+
+    scan() walks a list of files while the next `ahead` files are already
+    being read on a background thread, so I/O and decoding overlap with
+    whatever the caller does with the current one.
+    """
+
+    def __init__(self, max_mb=256, ahead=4):
+        self.max_bytes = int(max_mb * 2**20)
+        self.ahead = ahead
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.executor = None
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, path, gray, reduce):
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_mtime_ns, stat.st_size, gray, reduce
+
+    def _get(self, key):
+        with self.lock:
+            img = self.entries.get(key)
+            if img is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return img
+
+    def _put(self, key, img):
+        img.flags.writeable = False
+        with self.lock:
+            if img.nbytes > self.max_bytes or key in self.entries:
+                return
+            self.entries[key] = img
+            self.size += img.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def load(self, path, gray=False, reduce=1):
+        """imread(path) in colour or grayscale, at 1/reduce scale.
+
+        Returns None when the file cannot be read, like cv2.imread.
+        """
+        try:
+            key = self._key(path, gray, reduce)
+        except OSError:
+            return None
+
+        img = self._get(key)
+        if img is None:
+            img = cv2.imread(path, READ_FLAGS[(gray, reduce)])
+            if img is not None:
+                self._put(key, img)
+        return img
+
+    def decode(self, path, data, gray=False):
+        """Decode the already-read bytes of path at full size and cache them."""
+        try:
+            key = self._key(path, gray, 1)
+        except OSError:
+            key = None
+        img = self._get(key) if key is not None else None
+        if img is None:
+            img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), READ_FLAGS[(gray, 1)])
+            if img is not None and key is not None:
+                self._put(key, img)
+        return img
+
+    def scan(self, paths, read=None):
+        """Yield (path, read(path)) in order, reading ahead on a background thread.
+
+        read defaults to load(path); pass read_bytes to prefetch raw file
+        contents, or any function of the path to run it in the background.
+        """
+        read = read if read is not None else self.load
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        pending = deque()
+        paths = iter(paths)
+        for path in paths:
+            pending.append((path, self.executor.submit(read, path)))
+            if len(pending) > self.ahead:
+                break
+
+        while pending:
+            path, future = pending.popleft()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, self.executor.submit(read, next_path)))
+            try:
+                result = future.result()
+            except OSError:
+                result = None
+            yield path, result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "images": len(self.entries),
+                "mb": round(self.size / 2**20, 1),
+                "max_mb": round(self.max_bytes / 2**20, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+# Process-wide loader, shared by the index, the GUIs and the scripts
+shared_loader = ImageLoader()
@@ -0,0 +1,144 @@
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+from reference_index import FEATURE_CACHE_DIR, IMAGE_EXTENSIONS, ReferenceIndex, content_hash
+from sift2 import ratio_test
+
+
+def descriptor_overlap(bf, descriptors_a, descriptors_b):
+    """Fraction of the smaller descriptor set that survives the ratio test."""
+    if len(descriptors_a) < 2 or len(descriptors_b) < 2:
+        return 0.0
+    good_matches = ratio_test(bf.knnMatch(descriptors_a, descriptors_b, k=2))
+    return len(good_matches) / min(len(descriptors_a), len(descriptors_b))
+
+
+def find_near_duplicate(index, descriptors, threshold, bf=None):
+    bf = bf if bf is not None else cv2.BFMatcher()
+    best_name, best_overlap = None, 0.0
+    for entry in index:
+        overlap = descriptor_overlap(bf, descriptors, entry.descriptors)
+        if overlap > best_overlap:
+            best_name, best_overlap = entry.file_name, overlap
+    if best_overlap >= threshold:
+        return best_name, best_overlap
+    return None, best_overlap
+
+
+def ingest(index, source_paths, near_dup_threshold=0.5, force=False, dry_run=False):
+    """Copy new reference images into the repository under their content hash.
+
+    Exact duplicates (same bytes) are always skipped. Near duplicates, whose
+    descriptors overlap an existing reference by at least near_dup_threshold,
+    are skipped unless force is set. Only the added entries are computed and
+    written to the feature cache. Formats the index does not list (see
+    IMAGE_EXTENSIONS) are stored re-encoded as PNG.
+    """
+    known_hashes = {e.content_hash: e.file_name for e in index}
+    bf = cv2.BFMatcher()
+    added = []
+
+    for source in source_paths:
+        with open(source, "rb") as f:
+            data = f.read()
+        digest = content_hash(data)
+
+        if digest in known_hashes:
+            print(f"Skipped '{source}': identical to '{known_hashes[digest]}'")
+            continue
+
+        img_color = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img_color is None:
+            print(f"Skipped '{source}': not a readable image")
+            continue
+
+        ext = os.path.splitext(source)[1].lower()
+        if ext not in IMAGE_EXTENSIONS:
+            # Stored under another extension it would drop out of the next sync
+            data = cv2.imencode(".png", img_color)[1].tobytes()
+            digest = content_hash(data)
+            ext = ".png"
+            if digest in known_hashes:
+                print(f"Skipped '{source}': identical to '{known_hashes[digest]}'")
+                continue
+
+        file_name = f"{digest[:16]}{ext}"
+        entry = index.compute(img_color, file_name, digest)
+        if entry is None:
+            print(f"Skipped '{source}': no SIFT descriptors")
+            continue
+
+        duplicate_of, overlap = find_near_duplicate(index, entry.descriptors, near_dup_threshold, bf)
+        if duplicate_of and not force:
+            print(f"Skipped '{source}': near duplicate of '{duplicate_of}' ({overlap:.0%} overlap)")
+            continue
+
+        if not dry_run:
+            with open(os.path.join(index.repo_path, file_name), "wb") as f:
+                f.write(data)
+            index.insert(entry)
+        known_hashes[digest] = file_name
+        added.append(file_name)
+        print(f"Added '{source}' as '{file_name}' ({len(entry.keypoints)} keypoints)")
+
+    return added
+
+
+def remove(index, file_names, dry_run=False):
+    removed = []
+    for file_name in file_names:
+        path = os.path.join(index.repo_path, file_name)
+        if not os.path.exists(path):
+            print(f"Skipped '{file_name}': not in the repository")
+            continue
+        if not dry_run:
+            os.remove(path)
+            index.remove(file_name)
+        removed.append(file_name)
+        print(f"Removed '{file_name}'")
+    return removed
+
+
+def expand_sources(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for f in sorted(os.listdir(path)):
+                if f.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(path, f)
+        else:
+            yield path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the reference image repository.")
+    parser.add_argument("--repo", default="images/")
+    parser.add_argument("--dry-run", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = commands.add_parser("add", help="add images or folders of images")
+    add_parser.add_argument("paths", nargs="+")
+    add_parser.add_argument("--near-dup-threshold", type=float, default=0.5)
+    add_parser.add_argument("--force", action="store_true", help="keep near duplicates")
+
+    remove_parser = commands.add_parser("remove", help="remove references by file name")
+    remove_parser.add_argument("file_names", nargs="+")
+
+    commands.add_parser("sync", help="update the feature cache after manual edits")
+    args = parser.parse_args()
+
+    index = ReferenceIndex(args.repo, cache_dir=os.path.join(args.repo, FEATURE_CACHE_DIR))
+    index.build()
+
+    if args.command == "add":
+        ingest(index, expand_sources(args.paths), args.near_dup_threshold, args.force, args.dry_run)
+    elif args.command == "remove":
+        remove(index, args.file_names, args.dry_run)
+
+    if not args.dry_run:
+        pruned = index.prune_cache()
+        if pruned:
+            print(f"Pruned {len(pruned)} stale feature files")
+    print(f"{len(index)} references indexed")
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+def anms_select(keypoints, budget, robustness=0.9, chunk=512):
+    """Indices of `budget` keypoints spread evenly over the image.
+
+    Adaptive non-maximal suppression (Brown et al.): every keypoint gets the
+    distance to the nearest keypoint that is clearly stronger than it
+    (response_i < robustness * response_j). Keeping the largest radii picks
+    strong keypoints that are also far apart, instead of piling the whole
+    budget onto the most textured patch.
+    """
+    if budget is None or len(keypoints) <= budget:
+        return np.arange(len(keypoints))
+
+    responses = np.array([kp.response for kp in keypoints], dtype=np.float32)
+    pts = np.array([kp.pt for kp in keypoints], dtype=np.float32)
+
+    order = np.argsort(-responses)
+    responses = responses[order]
+    pts = pts[order]
+
+    radii = np.full(len(pts), np.inf, dtype=np.float32)
+    # Only stronger keypoints can suppress, and they come first after sorting
+    for start in range(0, len(pts), chunk):
+        stop = min(start + chunk, len(pts))
+        diff = pts[start:stop, None, :] - pts[None, :stop, :]
+        dist2 = np.einsum("ijk,ijk->ij", diff, diff)
+        stronger = responses[start:stop, None] < robustness * responses[None, :stop]
+        dist2[~stronger] = np.inf
+        radii[start:stop] = dist2.min(axis=1)
+
+    # Stable sort keeps the stronger keypoint first among equal radii
+    keep = np.argsort(-radii, kind="stable")[:budget]
+    return np.sort(order[keep])
+
+
+def apply_budget(keypoints, descriptors, budget, robustness=0.9):
+    if budget is None or len(keypoints) <= budget:
+        return keypoints, descriptors
+    keep = anms_select(keypoints, budget, robustness)
+    return [keypoints[i] for i in keep], descriptors[keep]
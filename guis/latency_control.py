@@ -0,0 +1,196 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import cv2
+
+
+@dataclass
+class Settings:
+    nfeatures: int = 5000
+    contrast_threshold: float = 0.04
+    # Input images are resized by this factor before extraction
+    scale: float = 1.0
+    # None evaluates every reference
+    max_references: int = None
+
+    def sift_factory(self):
+        return cv2.SIFT_create(nfeatures=self.nfeatures, contrastThreshold=self.contrast_threshold)
+
+    def resize(self, img):
+        if self.scale >= 1.0:
+            return img
+        return cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+
+class StageTimer:
+    """Wall time per named stage of one frame or query."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+class LatencyController:
+    """Feedback loop keeping per-frame latency inside a budget.
+
+    observe() takes the stage timings of every frame ("extract", "match"
+    and anything else) and keeps an exponential moving average of each.
+    When the average total is over budget by more than `tolerance`, one
+    setting is lowered, chosen by the stage that costs most: extraction is
+    relieved by fewer features, a higher contrast threshold and finally a
+    smaller input, matching by evaluating fewer references and keeping
+    fewer features. When latency is well under budget the most recent
+    change is undone first, so quality comes back in the reverse order it
+    was given up. After each change the controller waits `settle` frames
+    before judging again; a change that did not lower latency by at least
+    `min_gain` is undone and that setting is left alone until latency is
+    back under budget (nfeatures, for instance, saves little when most of
+    the time goes into building the scale space).
+
+    Every change is appended to `changes` and passed to `log`.
+    """
+
+    def __init__(self, budget_ms, settings=None, references=None, min_nfeatures=250,
+                 max_contrast_threshold=0.12, min_scale=0.4, min_references=5, tolerance=0.1,
+                 smoothing=0.3, settle=3, min_gain=0.05, log=print):
+        self.budget_ms = budget_ms
+        self.settings = settings if settings is not None else Settings()
+        self.references = references
+        self.min_nfeatures = min_nfeatures
+        self.max_contrast_threshold = max_contrast_threshold
+        self.min_scale = min_scale
+        self.min_references = min_references
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.settle = settle
+        self.min_gain = min_gain
+        self.log = log
+        self.average_ms = None
+        self.stage_ms = {}
+        self.since_change = 0
+        self.history = []
+        self.changes = []
+        # Latency before the last lowering step, to check it helped
+        self.before_ms = None
+        self.ineffective = set()
+
+    @classmethod
+    def for_fps(cls, fps, **kwargs):
+        return cls(1000.0 / fps, **kwargs)
+
+    def observe(self, timings):
+        """Record one frame's {stage: seconds}; returns True when settings changed."""
+        total_ms = sum(timings.values()) * 1000
+        alpha = self.smoothing
+        if self.average_ms is None:
+            self.average_ms = total_ms
+        else:
+            self.average_ms = alpha * total_ms + (1 - alpha) * self.average_ms
+        for name, seconds in timings.items():
+            previous = self.stage_ms.get(name, seconds * 1000)
+            self.stage_ms[name] = alpha * seconds * 1000 + (1 - alpha) * previous
+
+        self.since_change += 1
+        if self.since_change < self.settle:
+            return False
+
+        if self.before_ms is not None:
+            before, self.before_ms = self.before_ms, None
+            if self.average_ms > before * (1 - self.min_gain):
+                knob = self.history[-1][0]
+                self.ineffective.add(knob)
+                self._restore("no gain")
+                self.since_change = 0
+                return True
+
+        if self.average_ms > self.budget_ms * (1 + self.tolerance):
+            changed = self._lower()
+        elif self.average_ms < self.budget_ms * (1 - 2 * self.tolerance) and self.history:
+            changed = self._restore()
+        else:
+            changed = False
+        if changed:
+            self.since_change = 0
+        return changed
+
+    def _candidates(self):
+        s = self.settings
+        references = s.max_references if s.max_references is not None else self.references
+        # Take bigger steps while far over budget
+        severe = self.average_ms > 2 * self.budget_ms
+        factor = 0.5 if severe else 0.75
+        steps = {
+            "nfeatures": max(self.min_nfeatures, int(s.nfeatures * factor)) if s.nfeatures else None,
+            "contrast_threshold": min(
+                self.max_contrast_threshold, round(s.contrast_threshold + (0.04 if severe else 0.02), 3)
+            ),
+            "scale": max(self.min_scale, round(s.scale * (0.7 if severe else 0.85), 3)),
+            "max_references": (
+                max(self.min_references, int(references * factor)) if references else None
+            ),
+        }
+        if self.stage_ms.get("match", 0.0) > self.stage_ms.get("extract", 0.0):
+            order = ("max_references", "nfeatures", "contrast_threshold", "scale")
+        else:
+            order = ("nfeatures", "contrast_threshold", "scale", "max_references")
+
+        current = {
+            "nfeatures": s.nfeatures,
+            "contrast_threshold": s.contrast_threshold,
+            "scale": s.scale,
+            "max_references": references,
+        }
+        for knob in order:
+            if knob in self.ineffective:
+                continue
+            if steps[knob] is not None and steps[knob] != current[knob]:
+                yield knob, getattr(s, knob), steps[knob]
+
+    def _lower(self):
+        candidates = list(self._candidates())
+        if not candidates and self.ineffective:
+            # The scene may have changed since those were tried, try again
+            self.ineffective.clear()
+            candidates = list(self._candidates())
+        for knob, old, new in candidates:
+            self.history.append((knob, old))
+            self.before_ms = self.average_ms
+            self._apply(knob, old, new, "over budget")
+            return True
+        return False
+
+    def _restore(self, reason="under budget"):
+        knob, old = self.history.pop()
+        if reason == "under budget":
+            self.ineffective.clear()
+        self._apply(knob, getattr(self.settings, knob), old, reason)
+        return True
+
+    def _apply(self, knob, old, new, reason):
+        setattr(self.settings, knob, new)
+        change = {
+            "knob": knob,
+            "old": old,
+            "new": new,
+            "reason": reason,
+            "latency_ms": round(self.average_ms, 1),
+            "budget_ms": round(self.budget_ms, 1),
+            "stages_ms": {name: round(ms, 1) for name, ms in self.stage_ms.items()},
+        }
+        self.changes.append(change)
+        if self.log is not None:
+            self.log(
+                f"[latency] {reason} ({change['latency_ms']} ms / {change['budget_ms']} ms): "
+                f"{knob} {old} -> {new}"
+            )
+        # The averages describe the old settings, start over
+        self.average_ms = None
+        self.stage_ms = {}
@@ -0,0 +1,249 @@
+import argparse
+import itertools
+import os
+
+import cv2
+import numpy as np
+
+from image_loader import shared_loader
+from reference_index import FEATURE_CACHE_DIR, ReferenceIndex
+from sift2 import ratio_test
+
+# Pose bin sizes: location in quarters of the projected reference size,
+# orientation in 30 degree steps, scale in factors of two
+LOCATION_BIN = 0.25
+ANGLE_BIN = 30.0
+ANGLE_BINS = int(360 / ANGLE_BIN)
+
+
+def pose_arrays(keypoints):
+    points = np.float32([kp.pt for kp in keypoints]).reshape(-1, 2)
+    sizes = np.float32([kp.size for kp in keypoints])
+    angles = np.float32([kp.angle for kp in keypoints])
+    return points, sizes, angles
+
+
+def predict_poses(scene, reference, query_idx, train_idx, center):
+    """Pose of the reference implied by each match: (x, y, log2 scale, angle).
+
+    A scene keypoint and the reference keypoint it matches differ by a
+    similarity transform; applying it to the reference centre gives where
+    that centre lies in the scene.
+    """
+    scene_pts, scene_sizes, scene_angles = scene
+    ref_pts, ref_sizes, ref_angles = reference
+
+    scale = scene_sizes[query_idx] / ref_sizes[train_idx]
+    # Keypoint angles grow clockwise on screen (y points down)
+    angle = (scene_angles[query_idx] - ref_angles[train_idx]) % 360
+    theta = np.deg2rad(angle)
+    offset = center - ref_pts[train_idx]
+    cos, sin = np.cos(theta), np.sin(theta)
+    x = scene_pts[query_idx, 0] + scale * (cos * offset[:, 0] - sin * offset[:, 1])
+    y = scene_pts[query_idx, 1] + scale * (sin * offset[:, 0] + cos * offset[:, 1])
+    return x, y, np.log2(scale), angle
+
+
+def hough_clusters(x, y, log_scale, angle, extent, min_votes):
+    """Vote every match into the two closest bins of each pose dimension.
+
+    Returns lists of match indices, one per bin with at least min_votes
+    votes, largest first. Location bins are sized from the scale bin, so a
+    bin always covers the same fraction of the projected reference.
+    """
+    votes = {}
+    scale_bins = np.floor(log_scale - 0.5).astype(int)
+    angle_pos = angle / ANGLE_BIN - 0.5
+    angle_bins = np.floor(angle_pos).astype(int)
+    for m in range(len(x)):
+        scale_bins_m = (scale_bins[m], scale_bins[m] + 1)
+        angle_bins_m = (angle_bins[m] % ANGLE_BINS, (angle_bins[m] + 1) % ANGLE_BINS)
+        for s in scale_bins_m:
+            width = LOCATION_BIN * extent * 2.0 ** (s + 0.5)
+            bx = int(np.floor(x[m] / width - 0.5))
+            by = int(np.floor(y[m] / width - 0.5))
+            for a, dx, dy in itertools.product(angle_bins_m, (0, 1), (0, 1)):
+                votes.setdefault((s, a, bx + dx, by + dy), []).append(m)
+
+    clusters = [members for members in votes.values() if len(members) >= min_votes]
+    return sorted(clusters, key=len, reverse=True)
+
+
+def box_overlap(a, b):
+    """Intersection over the smaller box, so a box nested in another counts as 1."""
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    smaller = min((a[2] - a[0]) * (a[3] - a[1]), (b[2] - b[0]) * (b[3] - b[1]))
+    return inter / smaller if smaller > 0 else 0.0
+
+
+class MultiSignDetector:
+    """Every sign instance of a scene, from one pass over the library.
+
+    The scene is extracted once and matched against each reference. Every
+    ratio-test match predicts a pose of the reference in the scene (centre,
+    scale and rotation); matches that agree are grouped by generalized Hough
+    voting, so several copies of the same sign and several different signs
+    form separate clusters. Each cluster is verified with a RANSAC
+    similarity fit and its inliers map the reference's matched area onto
+    the scene, which gives the bounding region of that instance.
+    """
+
+    def __init__(self, index, min_votes=4, min_inliers=8, ransac_threshold=0.1, overlap=0.5):
+        self.index = index
+        self.min_votes = min_votes
+        self.min_inliers = min_inliers
+        # RANSAC reprojection threshold, as a fraction of the instance size
+        self.ransac_threshold = ransac_threshold
+        self.overlap = overlap
+        self.bf = cv2.BFMatcher()
+        self.references = {}
+
+    def _reference(self, entry):
+        cached = self.references.get(entry.file_name)
+        if cached is None or cached[0] is not entry.descriptors:
+            arrays = pose_arrays(entry.keypoints)
+            points = arrays[0]
+            low, high = points.min(axis=0), points.max(axis=0)
+            cached = (entry.descriptors, arrays, (low + high) / 2, float(max(high - low)) or 1.0)
+            self.references[entry.file_name] = cached
+        return cached[1], cached[2], cached[3]
+
+    def _verify(self, entry, scene, reference, query_idx, train_idx, members, extent, scale, angle):
+        src = reference[0][train_idx[members]]
+        dst = scene[0][query_idx[members]]
+        threshold = max(2.0, self.ransac_threshold * extent * scale)
+        matrix, inliers = cv2.estimateAffinePartial2D(
+            src, dst, method=cv2.RANSAC, ransacReprojThreshold=threshold
+        )
+        if matrix is None:
+            return None
+        inliers = inliers.ravel().astype(bool)
+        if inliers.sum() < self.min_inliers:
+            return None
+
+        # The fit must agree with the pose the cluster voted for, within the
+        # bin sizes; a few collinear points can fit a degenerate similarity
+        fit_scale = float(np.hypot(matrix[0, 0], matrix[1, 0]))
+        fit_angle = float(np.degrees(np.arctan2(matrix[1, 0], matrix[0, 0])))
+        angle_error = abs((fit_angle - angle + 180) % 360 - 180)
+        if abs(np.log2(fit_scale / scale)) > 1 or angle_error > ANGLE_BIN:
+            return None
+
+        # The matched part of the reference, carried into the scene
+        x1, y1 = src[inliers].min(axis=0)
+        x2, y2 = src[inliers].max(axis=0)
+        corners = np.float32([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
+        polygon = corners @ matrix[:, :2].T + matrix[:, 2]
+        bx1, by1 = polygon.min(axis=0)
+        bx2, by2 = polygon.max(axis=0)
+        return {
+            "reference": entry.file_name,
+            "inliers": int(inliers.sum()),
+            "votes": len(members),
+            "scale": fit_scale,
+            "angle": fit_angle,
+            "polygon": polygon.round(1).tolist(),
+            "bbox": [int(bx1), int(by1), int(np.ceil(bx2)), int(np.ceil(by2))],
+            "matches": [(int(q), int(t)) for q, t in zip(query_idx[members][inliers], train_idx[members][inliers])],
+        }
+
+    def detect(self, img_color, mask=None):
+        """All instances found in img_color, most inliers first.
+
+        Returns (instances, keypoints) where each instance is a dict with the
+        reference name, inlier and vote counts, the similarity pose, the
+        bounding polygon and box in scene pixels, and its (scene, reference)
+        keypoint index pairs.
+        """
+        img = cv2.cvtColor(img_color, cv2.COLOR_BGR2GRAY) if img_color.ndim == 3 else img_color
+        keypoints, descriptors = self.index.sift.detectAndCompute(img, mask)
+        if descriptors is None or len(keypoints) < 2:
+            return [], keypoints
+        scene = pose_arrays(keypoints)
+
+        candidates = []
+        for entry in self.index:
+            good = ratio_test(self.bf.knnMatch(descriptors, entry.descriptors, k=2))
+            if len(good) < self.min_votes:
+                continue
+            query_idx = np.array([m[0].queryIdx for m in good])
+            train_idx = np.array([m[0].trainIdx for m in good])
+
+            reference, center, extent = self._reference(entry)
+            x, y, log_scale, angle = predict_poses(scene, reference, query_idx, train_idx, center)
+
+            claimed = np.zeros(len(good), dtype=bool)
+            for members in hough_clusters(x, y, log_scale, angle, extent, self.min_votes):
+                # A match belongs to at most one instance of a reference
+                members = np.array([m for m in members if not claimed[m]])
+                if len(members) < self.min_votes:
+                    continue
+                scale = float(2.0 ** np.median(log_scale[members]))
+                # Circular mean, the votes may straddle 0/360 degrees
+                radians = np.deg2rad(angle[members])
+                mean_angle = float(np.degrees(np.arctan2(np.sin(radians).mean(), np.cos(radians).mean())))
+                instance = self._verify(
+                    entry, scene, reference, query_idx, train_idx, members, extent, scale, mean_angle
+                )
+                if instance is None:
+                    continue
+                claimed[members] = True
+                candidates.append(instance)
+
+        # Overlapping instances are the same sign seen through several
+        # references (or split clusters), keep the best supported one
+        instances = []
+        for candidate in sorted(candidates, key=lambda c: c["inliers"], reverse=True):
+            if all(box_overlap(candidate["bbox"], kept["bbox"]) < self.overlap for kept in instances):
+                instances.append(candidate)
+        return instances, keypoints
+
+
+def draw_instances(img_color, instances):
+    output = img_color.copy()
+    for instance in instances:
+        polygon = np.int32(np.round(instance["polygon"])).reshape(-1, 1, 2)
+        cv2.polylines(output, [polygon], True, (0, 255, 0), 2)
+        x1, y1 = instance["bbox"][:2]
+        cv2.putText(
+            output,
+            f"{instance['reference']} ({instance['inliers']})",
+            (x1, max(12, y1 - 6)),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.5,
+            (0, 255, 0),
+            1,
+        )
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find every known sign in a scene.")
+    parser.add_argument("scene")
+    parser.add_argument("--repo", default="images/")
+    parser.add_argument("--output", help="write the scene with the instances drawn on it")
+    parser.add_argument("--min-inliers", type=int, default=8)
+    parser.add_argument("--mask", action="store_true", help="use references masked to their signs")
+    args = parser.parse_args()
+
+    img = shared_loader.load(args.scene)
+    if img is None:
+        raise FileNotFoundError(f"Input image {args.scene} not found.")
+
+    index = ReferenceIndex(
+        args.repo, cache_dir=os.path.join(args.repo, FEATURE_CACHE_DIR), masked=args.mask
+    ).build()
+    detector = MultiSignDetector(index, min_inliers=args.min_inliers)
+    instances, _ = detector.detect(img)
+
+    for instance in instances:
+        print(
+            f"{instance['reference']}: {instance['inliers']} inliers ({instance['votes']} votes), "
+            f"bbox {instance['bbox']}, scale {instance['scale']:.2f}, angle {instance['angle']:.0f}"
+        )
+    if not instances:
+        print("No sign found.")
+    if args.output:
+        cv2.imwrite(args.output, draw_instances(img, instances))
@@ -0,0 +1,285 @@
+import hashlib
+import os
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from image_loader import read_bytes, shared_loader
+from keypoint_budget import apply_budget
+from sign_regions import classify_signs, contours_mask, find_sign_contours
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# Default location of the on-disk feature cache, inside the repository folder
+FEATURE_CACHE_DIR = ".sift_features"
+
+
+@dataclass
+class ReferenceEntry:
+    file_name: str
+    keypoints: list
+    descriptors: np.ndarray
+    shape: tuple
+    content_hash: str = None
+    # Sign shapes and colours found in the image, empty when none were found
+    shapes: tuple = ()
+    colours: tuple = ()
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def keypoints_to_array(keypoints):
+    return np.array(
+        [
+            (kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave, kp.class_id)
+            for kp in keypoints
+        ],
+        dtype=np.float32,
+    ).reshape(-1, 7)
+
+
+def array_to_keypoints(array):
+    return [
+        cv2.KeyPoint(float(x), float(y), float(size), float(angle), float(response), int(octave), int(class_id))
+        for x, y, size, angle, response, octave, class_id in array
+    ]
+
+
+class ReferenceIndex:
+    """SIFT features of every image in a repository folder, computed once.
+
+    find_best_match recomputes these for every query; long-running callers
+    (the service, the camera loop) build an index once and keep it warm.
+
+    With a cache_dir, features are also stored on disk keyed by the content
+    hash of each image, so renaming a file or restarting a process does not
+    trigger a rescan, and sync() only touches added, changed or removed files.
+
+    With masked=True, features are only extracted inside the detected sign
+    outlines of each reference (see sign_regions.sign_mask), leaving out the
+    sky, poles and roadside around it.
+
+    With a budget, each reference keeps at most that many keypoints, chosen
+    by adaptive non-maximal suppression, which bounds the matching cost of
+    heavily textured references.
+
+    Every entry is tagged with the shapes and colours of the signs it shows,
+    so partition() can narrow a query down to references of the same kind.
+
+    Files are read through an ImageLoader: while features of the current
+    file are computed, sync() reads, hashes and (unless its features are
+    already known) decodes the next files in the background, and decoded
+    references stay in the loader's cache for load_color(). Long-running
+    processes pass a loader with a small or zero cache, so references do
+    not stay decoded for the life of the process.
+    """
+
+    def __init__(self, repo_path, sift=None, cache_dir=None, masked=False, budget=None,
+                 loader=None):
+        self.repo_path = repo_path
+        self.sift = sift if sift is not None else cv2.SIFT_create()
+        self.loader = loader if loader is not None else shared_loader
+        self.cache_dir = cache_dir
+        self.masked = masked
+        self.budget = budget
+        # Cached features are only valid for the settings that produced them
+        self.variant = "masked" if masked else "full"
+        if budget:
+            self.variant += f"-b{budget}"
+        self.entries = {}
+
+    def build(self):
+        self.sync()
+        return self
+
+    def list_images(self):
+        return sorted(
+            f for f in os.listdir(self.repo_path) if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+    def sync(self):
+        """Bring the index in line with the folder; returns (added, removed)."""
+        on_disk = set(self.list_images())
+        removed = [f for f in self.entries if f not in on_disk]
+        for file_name in removed:
+            self.remove(file_name)
+
+        added = []
+        paths = [os.path.join(self.repo_path, f) for f in sorted(on_disk)]
+        for path, prefetched in self.loader.scan(paths, self._prefetch):
+            if prefetched is None:
+                continue
+            data, digest, img_repo_color = prefetched
+            file_name = os.path.basename(path)
+            known = self.entries.get(file_name)
+            if known is not None and known.content_hash == digest:
+                continue
+            if self.add(file_name, data, digest, img_repo_color) is not None:
+                added.append(file_name)
+        return added, removed
+
+    def _prefetch(self, path):
+        # Runs on the loader's prefetch thread: (data, digest, decoded image),
+        # the image is None when the features need not be computed
+        data = read_bytes(path)
+        digest = content_hash(data)
+        known = self.entries.get(os.path.basename(path))
+        if (known is not None and known.content_hash == digest) or self._has_cached(digest):
+            return data, digest, None
+        return data, digest, self.loader.decode(path, data)
+
+    def compute(self, img_repo_color, file_name, digest=None):
+        img_repo = cv2.cvtColor(img_repo_color, cv2.COLOR_BGR2GRAY)
+        found = find_sign_contours(img_repo_color)
+        mask = None
+        if self.masked and found:
+            mask = contours_mask(img_repo.shape, [contour for _, contour in found])
+
+        kp_repo, descriptors_repo = self.sift.detectAndCompute(img_repo, mask)
+        if descriptors_repo is None:
+            return None
+        kp_repo, descriptors_repo = apply_budget(kp_repo, descriptors_repo, self.budget)
+
+        signs = classify_signs(img_repo_color, found)
+        return ReferenceEntry(
+            file_name,
+            kp_repo,
+            descriptors_repo,
+            img_repo.shape,
+            digest,
+            shapes=tuple(sorted({shape for shape, _ in found})),
+            colours=tuple(sorted({colour for _, colour in signs})),
+        )
+
+    def add(self, file_name, data=None, digest=None, img_repo_color=None):
+        path = os.path.join(self.repo_path, file_name)
+        if data is None:
+            data = read_bytes(path)
+        if digest is None:
+            digest = content_hash(data)
+
+        entry = self._load_cached(file_name, digest)
+        if entry is None:
+            if img_repo_color is None:
+                img_repo_color = self.loader.decode(path, data)
+            if img_repo_color is None:
+                return None
+            entry = self.compute(img_repo_color, file_name, digest)
+            if entry is None:
+                return None
+            self._save_cached(entry)
+
+        self.entries[file_name] = entry
+        return entry
+
+    def insert(self, entry):
+        self.entries[entry.file_name] = entry
+        self._save_cached(entry)
+
+    def remove(self, file_name):
+        return self.entries.pop(file_name, None)
+
+    def load_color(self, file_name):
+        # Shared with the loader cache, copy before drawing on it
+        return self.loader.load(os.path.join(self.repo_path, file_name))
+
+    def _cache_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.{self.variant}.npz")
+
+    def _has_cached(self, digest):
+        return bool(self.cache_dir) and os.path.exists(self._cache_path(digest))
+
+    def _load_cached(self, file_name, digest):
+        if not self._has_cached(digest):
+            return None
+        with np.load(self._cache_path(digest)) as cached:
+            if "shapes" not in cached:
+                # Written before shape tagging, recompute
+                return None
+            return ReferenceEntry(
+                file_name,
+                array_to_keypoints(cached["keypoints"]),
+                cached["descriptors"],
+                tuple(cached["shape"]),
+                digest,
+                shapes=tuple(str(s) for s in cached["shapes"]),
+                colours=tuple(str(c) for c in cached["colours"]),
+            )
+
+    def _save_cached(self, entry):
+        if not self.cache_dir or entry.content_hash is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(entry.content_hash)
+        # Write then rename so a crash never leaves a truncated cache file
+        with open(path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                keypoints=keypoints_to_array(entry.keypoints),
+                descriptors=entry.descriptors,
+                shape=np.array(entry.shape),
+                shapes=np.array(entry.shapes, dtype=str),
+                colours=np.array(entry.colours, dtype=str),
+            )
+        os.replace(path + ".tmp", path)
+
+    def prune_cache(self):
+        """Delete cached features of images no longer in the index.
+
+        Every variant of a removed or changed image goes, not only this
+        index's: masked or budgeted features of a live image are kept.
+        """
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return []
+        live = {e.content_hash for e in self.entries.values()}
+        stale = [
+            f for f in os.listdir(self.cache_dir)
+            if f.endswith(".npz") and f.split(".", 1)[0] not in live
+        ]
+        for f in stale:
+            os.remove(os.path.join(self.cache_dir, f))
+        return stale
+
+    def partition(self, shape, colour=None):
+        """References that may show a sign of this shape (and colour).
+
+        Untagged references, where no sign outline was found, belong to every
+        partition. The colour is dropped if it would leave no tagged entry.
+        """
+        entries = list(self.entries.values())
+        untagged = [e for e in entries if not e.shapes]
+        same_shape = [e for e in entries if shape in e.shapes]
+        if colour is not None:
+            same_colour = [e for e in same_shape if colour in e.colours]
+            if same_colour:
+                same_shape = same_colour
+        return same_shape + untagged
+
+    def partition_sizes(self):
+        sizes = {}
+        for entry in self.entries.values():
+            for shape in entry.shapes or ("untagged",):
+                sizes[shape] = sizes.get(shape, 0) + 1
+        return sizes
+
+    def stats(self):
+        keypoints = sum(len(e.keypoints) for e in self.entries.values())
+        nbytes = sum(e.descriptors.nbytes for e in self.entries.values())
+        return {
+            "references": len(self.entries),
+            "keypoints": keypoints,
+            "max_keypoints": max((len(e.keypoints) for e in self.entries.values()), default=0),
+            "descriptor_mb": round(nbytes / 2**20, 2),
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries.values()))
+
+    def __contains__(self, file_name):
+        return file_name in self.entries
@@ -0,0 +1,137 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PyQt6.QtCore import QRectF, Qt, QTimer
+from PyQt6.QtGui import QImage, QPainter, QPixmap
+
+
+def array_to_qimage(img):
+    # Qt reads BGR directly, so no cvtColor pass over the whole image
+    img = np.ascontiguousarray(img)
+    height, width = img.shape[:2]
+    if img.ndim == 2:
+        fmt = QImage.Format.Format_Grayscale8
+    else:
+        fmt = QImage.Format.Format_BGR888
+    # copy() detaches the QImage from the numpy buffer it was built on
+    return QImage(img.data, width, height, img.strides[0], fmt).copy()
+
+
+def array_to_pixmap(img, target_size=None):
+    """Convert a BGR/gray array to a pixmap that fits target_size.
+
+    Downscaling happens in OpenCV (INTER_AREA) before the Qt conversion, so
+    only the pixels that will actually be shown get converted and uploaded.
+    """
+    if target_size is not None:
+        height, width = img.shape[:2]
+        scale = min(target_size.width() / width, target_size.height() / height)
+        if scale > 0 and scale != 1:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+            img = cv2.resize(img, size, interpolation=interpolation)
+    return QPixmap.fromImage(array_to_qimage(img))
+
+
+class ScaledPixmapCache:
+    """Smoothly scaled copies of a pixmap, one per zoom level (LRU)."""
+
+    def __init__(self, max_entries=4, max_pixels=16_000_000):
+        self.max_entries = max_entries
+        # Past this size a scaled copy costs more memory than it saves time
+        self.max_pixels = max_pixels
+        self.entries = OrderedDict()
+
+    def _key(self, pixmap, zoom):
+        return (pixmap.cacheKey(), round(zoom, 4))
+
+    def get(self, pixmap, zoom):
+        key = self._key(pixmap, zoom)
+        scaled = self.entries.get(key)
+        if scaled is not None:
+            self.entries.move_to_end(key)
+        return scaled
+
+    def build(self, pixmap, zoom):
+        width = max(1, round(pixmap.width() * zoom))
+        height = max(1, round(pixmap.height() * zoom))
+        if (width, height) == (pixmap.width(), pixmap.height()):
+            # Nothing to resample, the source is drawn as it is
+            return pixmap
+        if width * height > self.max_pixels:
+            return None
+
+        scaled = pixmap.scaled(
+            width,
+            height,
+            Qt.AspectRatioMode.IgnoreAspectRatio,
+            Qt.TransformationMode.SmoothTransformation,
+        )
+        self.entries[self._key(pixmap, zoom)] = scaled
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return scaled
+
+    def clear(self):
+        self.entries.clear()
+
+
+class ViewportRenderer:
+    """Draws the visible part of a zoomed pixmap for a widget.
+
+    While the user pans or zooms, the visible region is drawn straight from
+    the source pixmap with a fast transform. Once input has been idle for
+    idle_ms, a smooth copy for the current zoom is built and cached, and
+    later paints at that zoom are a plain blit of the visible region.
+    """
+
+    def __init__(self, widget, idle_ms=150):
+        self.widget = widget
+        self.cache = ScaledPixmapCache()
+        self.interacting = False
+        self.idle_timer = QTimer(widget)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(idle_ms)
+        self.idle_timer.timeout.connect(self._on_idle)
+
+    def interact(self):
+        self.interacting = True
+        self.idle_timer.start()
+
+    def _on_idle(self):
+        self.interacting = False
+        self.widget.update()
+
+    def paint(self, painter, pixmap, target_rect, clip_rect):
+        # Snap to whole pixels so cached copies are blitted without resampling
+        target_rect = QRectF(
+            round(target_rect.x()), round(target_rect.y()), target_rect.width(), target_rect.height()
+        )
+        visible = target_rect.intersected(clip_rect)
+        if visible.isEmpty():
+            return
+
+        zoom = target_rect.width() / pixmap.width()
+        if (target_rect.width(), target_rect.height()) == (pixmap.width(), pixmap.height()):
+            # At 100% the source is blitted directly, even while interacting
+            scaled = pixmap
+        else:
+            scaled = self.cache.get(pixmap, zoom)
+            if scaled is None and not self.interacting:
+                scaled = self.cache.build(pixmap, zoom)
+
+        if scaled is not None:
+            source = visible.translated(-target_rect.x(), -target_rect.y())
+            painter.drawPixmap(visible, scaled, source)
+            return
+
+        # Map the visible region back to source pixels and draw only that
+        source = QRectF(
+            (visible.x() - target_rect.x()) / zoom,
+            (visible.y() - target_rect.y()) / zoom,
+            visible.width() / zoom,
+            visible.height() / zoom,
+        )
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, not self.interacting)
+        painter.drawPixmap(visible, pixmap, source)
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def dhash(img, hash_size=8):
+    """Difference hash of an image as a 64-bit int (for hash_size=8).
+
+    The image is normalized to a small grayscale thumbnail first, so the same
+    sign crop saved at another size or with slight noise hashes the same or
+    within a few bits.
+    """
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class ResultCache:
+    """LRU/TTL cache of match results keyed by perceptual hash.
+
+    A lookup hits when a stored hash is within max_distance bits of the query
+    hash. Exact hashes are found with a dict lookup; the tolerant scan only
+    runs over the (bounded) cache on a miss.
+
+    key_fn(img) replaces the whole-image hash; with max_distance=0 its keys
+    may be any hashable value, and None means "do not cache this image".
+    ttl is measured on clock(), wall seconds by default.
+    """
+
+    def __init__(self, max_size=256, ttl=300.0, max_distance=4, hash_size=8, key_fn=None,
+                 clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.key_fn = key_fn
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, img):
+        if self.key_fn is not None:
+            return self.key_fn(img)
+        return dhash(img, self.hash_size)
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and self.clock() - stored_at > self.ttl
+
+    def get(self, key):
+        with self.lock:
+            found = key if key in self.entries else None
+            if found is None and self.max_distance:
+                for candidate in self.entries:
+                    if hamming(candidate, key) <= self.max_distance:
+                        found = candidate
+                        break
+
+            if found is not None:
+                stored_at, value = self.entries[found]
+                if not self._expired(stored_at):
+                    self.entries.move_to_end(found)
+                    self.hits += 1
+                    return value
+                del self.entries[found]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.clock(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+def cached_match(cache, img_input_color, match_fn):
+    """Return match_fn(img_input_color), served from cache when possible."""
+    key = cache.key(img_input_color)
+    if key is None:
+        return match_fn(img_input_color)
+    result = cache.get(key)
+    if result is None:
+        result = match_fn(img_input_color)
+        cache.put(key, result)
+    return result
@@ -0,0 +1,332 @@
+import argparse
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+from gemm_matching import GemmMatcher
+from image_loader import ImageLoader, read_bytes
+from reference_index import (
+    FEATURE_CACHE_DIR,
+    ReferenceIndex,
+    array_to_keypoints,
+    content_hash,
+    keypoints_to_array,
+)
+from sift2 import match_batch
+
+
+def _pack(result):
+    best_match, score, best_kp, best_matches = result
+    if best_match is None:
+        return None, 0.0, None, None
+    matches = np.float32(
+        [(m[0].queryIdx, m[0].trainIdx, m[0].distance) for m in best_matches]
+    ).reshape(-1, 3)
+    return best_match, float(score), keypoints_to_array(best_kp), matches
+
+
+def _unpack(packed):
+    best_match, score, kp_array, matches = packed
+    if best_match is None:
+        return None, 0, None, None
+    good_matches = [[cv2.DMatch(int(q), int(t), float(d))] for q, t, d in matches]
+    return best_match, score, array_to_keypoints(kp_array), good_matches
+
+
+def _worker_main(conn, repo_path, cache_dir, masked, budget, engine):
+    # Features come from the shared on-disk cache, so a restarted worker is
+    # warm again as soon as it has re-read its files. Nothing stays decoded,
+    # a worker lives as long as the index and never redraws a reference
+    index = ReferenceIndex(
+        repo_path, cache_dir=cache_dir, masked=masked, budget=budget, loader=ImageLoader(max_mb=0)
+    )
+    gemm = GemmMatcher(index) if engine == "gemm" else None
+    bf = cv2.BFMatcher()
+
+    while True:
+        try:
+            command, payload = conn.recv()
+        except EOFError:
+            break
+
+        if command == "add":
+            loads = {}
+            for file_name in payload:
+                entry = index.add(file_name)
+                loads[file_name] = len(entry.descriptors) if entry is not None else 0
+            conn.send(loads)
+        elif command == "remove":
+            for file_name in payload:
+                index.remove(file_name)
+            conn.send(True)
+        elif command == "match":
+            queries, min_matches = payload
+            start = time.perf_counter()
+            if gemm is not None:
+                results = gemm.match(queries, min_matches)
+            else:
+                results = match_batch(index, queries, min_matches, bf)
+            conn.send(([_pack(r) for r in results], time.perf_counter() - start))
+        elif command == "stop":
+            conn.send(True)
+            break
+
+
+class ShardedIndex:
+    """Reference library split over persistent worker processes.
+
+    Each worker holds the features of its shard. match() sends the query
+    descriptors to every shard at once and keeps the best-scoring reference
+    across shards, so a single query uses as many cores as there are shards.
+
+    References are placed on the shard with the smallest descriptor load and
+    rebalance() moves references when the loads drift apart. A worker that
+    died or stopped answering is restarted and reloads its references.
+    """
+
+    def __init__(self, repo_path, shards=None, cache_dir=None, masked=False, budget=None,
+                 engine="bf", timeout=120):
+        self.repo_path = repo_path
+        self.shards = shards or os.cpu_count() or 1
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(repo_path, FEATURE_CACHE_DIR)
+        self.masked = masked
+        self.budget = budget
+        self.engine = engine
+        self.timeout = timeout
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = [None] * self.shards
+        self.assignment = {}
+        self.loads = {}
+        # Content hash of every assigned file as last loaded
+        self.digests = {}
+        self.restarts = 0
+
+    def _spawn(self, shard):
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(
+            target=_worker_main,
+            args=(child_conn, self.repo_path, self.cache_dir, self.masked, self.budget, self.engine),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self.workers[shard] = (process, parent_conn)
+
+    def _request(self, shard, command, payload=None):
+        _, conn = self.workers[shard]
+        conn.send((command, payload))
+
+    def _reply(self, shard):
+        process, conn = self.workers[shard]
+        if not conn.poll(self.timeout):
+            raise TimeoutError(f"shard {shard} did not answer within {self.timeout} s")
+        return conn.recv()
+
+    def restart(self, shard):
+        process, conn = self.workers[shard] or (None, None)
+        if process is not None:
+            process.kill()
+            process.join()
+            conn.close()
+        self._spawn(shard)
+        self.restarts += 1
+
+        files = [f for f, s in self.assignment.items() if s == shard]
+        if files:
+            self._request(shard, "add", files)
+            self.loads.update(self._reply(shard))
+
+    def _call(self, requests):
+        """Send {shard: (command, payload)} to the shards at once; returns {shard: reply}.
+
+        A shard whose pipe broke or that did not answer in time is restarted
+        and asked once more. Every command is safe to repeat: a restarted
+        worker first reloads the references assigned to it.
+        """
+        replies = {}
+        for attempt in range(2):
+            sent = []
+            for shard in [s for s in requests if s not in replies]:
+                try:
+                    self._request(shard, *requests[shard])
+                    sent.append(shard)
+                except (BrokenPipeError, OSError):
+                    if attempt:
+                        raise
+                    self.restart(shard)
+            for shard in sent:
+                try:
+                    replies[shard] = self._reply(shard)
+                except (EOFError, OSError, TimeoutError):
+                    if attempt:
+                        raise
+                    self.restart(shard)
+            if len(replies) == len(requests):
+                break
+        return replies
+
+    def _ensure_alive(self):
+        for shard, worker in enumerate(self.workers):
+            if worker is None or not worker[0].is_alive():
+                self.restart(shard)
+
+    def shard_loads(self):
+        loads = [0] * self.shards
+        for file_name, shard in self.assignment.items():
+            loads[shard] += self.loads.get(file_name, 0)
+        return loads
+
+    def start(self):
+        for shard in range(self.shards):
+            self._spawn(shard)
+        self.sync()
+        return self
+
+    def sync(self):
+        """Pick up added, changed and removed repository images; returns (added, removed).
+
+        As in ReferenceIndex.sync, a file whose content changed is reloaded by
+        its shard and reported as added.
+        """
+        self._ensure_alive()
+        digests = {
+            f: content_hash(read_bytes(os.path.join(self.repo_path, f)))
+            for f in ReferenceIndex(self.repo_path).list_images()
+        }
+        removed = [f for f in self.assignment if f not in digests]
+        changed = sorted(
+            f for f in self.assignment if f in digests and self.digests.get(f) != digests[f]
+        )
+        added = sorted(f for f in digests if f not in self.assignment)
+
+        by_shard = {}
+        for file_name in removed:
+            by_shard.setdefault(self.assignment.pop(file_name), []).append(file_name)
+            self.loads.pop(file_name, None)
+            self.digests.pop(file_name, None)
+        # A changed file is dropped first, so its old features do not survive
+        # when the new content cannot be read
+        for file_name in changed:
+            by_shard.setdefault(self.assignment[file_name], []).append(file_name)
+        self._call({shard: ("remove", files) for shard, files in by_shard.items()})
+
+        # Loads of new files are unknown until a worker has read them, so the
+        # first placement is round robin over the lightest shards
+        loads = self.shard_loads()
+        order = sorted(range(self.shards), key=lambda s: loads[s])
+        pending = {}
+        for file_name in changed:
+            pending.setdefault(self.assignment[file_name], []).append(file_name)
+        for i, file_name in enumerate(added):
+            shard = order[i % self.shards]
+            self.assignment[file_name] = shard
+            pending.setdefault(shard, []).append(file_name)
+        for loads in self._call({shard: ("add", files) for shard, files in pending.items()}).values():
+            self.loads.update(loads)
+        self.digests.update({f: digests[f] for f in changed + added})
+
+        self.rebalance()
+        return sorted(changed + added), removed
+
+    def rebalance(self, tolerance=0.1):
+        """Move references from the heaviest to the lightest shard while it helps."""
+        moves = []
+        while True:
+            loads = self.shard_loads()
+            heavy = max(range(self.shards), key=lambda s: loads[s])
+            light = min(range(self.shards), key=lambda s: loads[s])
+            gap = loads[heavy] - loads[light]
+            if gap <= tolerance * (sum(loads) / self.shards):
+                break
+            # The largest reference that still narrows the gap
+            candidates = [
+                f for f, s in self.assignment.items()
+                if s == heavy and 0 < self.loads.get(f, 0) < gap
+            ]
+            if not candidates:
+                break
+            file_name = max(candidates, key=lambda f: self.loads[f])
+            self.assignment[file_name] = light
+            moves.append((file_name, heavy, light))
+
+        removes, adds = {}, {}
+        for file_name, heavy, light in moves:
+            removes.setdefault(heavy, []).append(file_name)
+            adds.setdefault(light, []).append(file_name)
+        # A reference moved twice is removed from the first shard and only
+        # loaded by the last one
+        for shard, files in adds.items():
+            adds[shard] = [f for f in files if self.assignment[f] == shard]
+        self._call({shard: ("remove", files) for shard, files in removes.items()})
+        for loads in self._call({shard: ("add", files) for shard, files in adds.items() if files}).values():
+            self.loads.update(loads)
+        return moves
+
+    def match(self, queries, min_matches=10):
+        """Scatter queries to all shards and merge; same output as match_batch."""
+        self._ensure_alive()
+        payload = ([(np.asarray(d, dtype=np.float32) if d is not None else None, e) for d, e in queries],
+                   min_matches)
+
+        replies = self._call({shard: ("match", payload) for shard in range(self.shards)})
+        replies = [replies[shard] for shard in range(self.shards)]
+
+        self.last_shard_seconds = [seconds for _, seconds in replies]
+        merged = [(None, 0.0, None, None) for _ in queries]
+        for packed_results, _ in replies:
+            for q, packed in enumerate(packed_results):
+                if packed[0] is not None and packed[1] > merged[q][1]:
+                    merged[q] = packed
+        return [_unpack(packed) for packed in merged]
+
+    def close(self):
+        for shard, worker in enumerate(self.workers):
+            if worker is None:
+                continue
+            process, conn = worker
+            try:
+                self._request(shard, "stop")
+                self._reply(shard)
+            except (BrokenPipeError, EOFError, OSError, TimeoutError):
+                pass
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+            conn.close()
+            self.workers[shard] = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match images against a sharded reference library.")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--repo", default="images/")
+    parser.add_argument("--shards", type=int, default=os.cpu_count())
+    parser.add_argument("--engine", choices=("bf", "gemm"), default="bf")
+    parser.add_argument("--min-matches", type=int, default=10)
+    args = parser.parse_args()
+
+    sift = cv2.SIFT_create()
+    sharded = ShardedIndex(args.repo, args.shards, engine=args.engine).start()
+    print(f"{len(sharded.assignment)} references over {sharded.shards} shards, loads {sharded.shard_loads()}")
+    try:
+        for path in args.images:
+            img = cv2.imread(path)
+            if img is None:
+                raise FileNotFoundError(f"Input image {path} not found.")
+            _, descriptors = sift.detectAndCompute(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), None)
+
+            start = time.perf_counter()
+            best_match, score, _, best_matches = sharded.match(
+                [(descriptors, os.path.basename(path))], args.min_matches
+            )[0]
+            elapsed = (time.perf_counter() - start) * 1000
+            shard_ms = ", ".join(f"{s * 1000:.0f}" for s in sharded.last_shard_seconds)
+            if best_match:
+                print(f"{path}: {best_match} score {score:.2f} ({len(best_matches)} matches) in {elapsed:.0f} ms [shards: {shard_ms} ms]")
+            else:
+                print(f"{path}: no match in {elapsed:.0f} ms [shards: {shard_ms} ms]")
+    finally:
+        sharded.close()
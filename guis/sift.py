@@ -1,31 +1,45 @@
+import argparse
 import numpy as np
 import cv2
-from matplotlib import pyplot as plt
 import os
+import sys
+import time
 
-def find_best_match(query_image_path, images_folder_path):
-    img1 = cv2.imread(query_image_path, 0)
-    sift = cv2.SIFT_create(nfeatures=5000)
+from image_loader import shared_loader
+from latency_control import LatencyController, Settings, StageTimer
+
+def find_best_match(query_image_path, images_folder_path, settings=None, timer=None, preferred=None):
+    # settings default to nfeatures=5000 at full size over every reference;
+    # preferred references are evaluated first when max_references cuts the list
+    settings = settings if settings is not None else Settings()
+    timer = timer if timer is not None else StageTimer()
+    img1 = shared_loader.load(query_image_path, gray=True)
+    sift = settings.sift_factory()
     bf = cv2.BFMatcher()
 
     best_match = None
     max_good_matches = 0
 
-    kp1, des1 = sift.detectAndCompute(img1, None)
+    with timer.stage("extract"):
+        kp1, des1 = sift.detectAndCompute(settings.resize(img1), None)
     if des1 is None:
         print("Pas de descripteurs pour l'image de requête. Veuillez vérifier l'image.")
-        return None
-
-    for filename in os.listdir(images_folder_path):
-        if filename.endswith('.png'):
-            img2 = cv2.imread(os.path.join(images_folder_path, filename), 0)
+        return None, 0
 
-            kp2, des2 = sift.detectAndCompute(img2, None)
+    filenames = [f for f in os.listdir(images_folder_path) if f.endswith('.png')]
+    filenames.sort(key=lambda f: f not in (preferred or ()))
+    paths = [os.path.join(images_folder_path, f) for f in filenames[:settings.max_references]]
+    for path, img2 in shared_loader.scan(paths, lambda p: shared_loader.load(p, gray=True)):
+        filename = os.path.basename(path)
+        if img2 is not None:
+            with timer.stage("extract"):
+                kp2, des2 = sift.detectAndCompute(settings.resize(img2), None)
             if des2 is None:
                 print(f"Pas de descripteurs pour l'image {filename}. Ignorée.")
                 continue
 
-            matches = bf.knnMatch(des1, des2, k=2)
+            with timer.stage("match"):
+                matches = bf.knnMatch(des1, des2, k=2)
             good = []
             for m, n in matches:
                 if m.distance < 0.75 * n.distance:  
@@ -37,18 +51,59 @@ def find_best_match(query_image_path, images_folder_path):
 
     if best_match:
         print(f"Meilleur match : {best_match} avec {max_good_matches} correspondances.")
-        img2 = cv2.imread(os.path.join(images_folder_path, best_match), 0)
-        kp2, des2 = sift.detectAndCompute(img2, None)
-        matches = bf.knnMatch(des1, des2, k=2)
-        good = []
-        for m, n in matches:
-            if m.distance < 0.8 * n.distance:
-                good.append([m])
-        img_matches = cv2.drawMatchesKnn(img1, kp1, img2, kp2, good, None, flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
-        plt.imshow(img_matches)
-        plt.title('Correspondances')
-        plt.show()
     else:
         print("Aucun match significatif trouvé.")
 
-find_best_match('inputs/image3.png', 'images')
+    return best_match, max_good_matches
+
+
+def show_best_match(query_image_path, images_folder_path, best_match):
+    from visualize import plot_knn_matches
+
+    img1 = shared_loader.load(query_image_path, gray=True)
+    sift = cv2.SIFT_create(nfeatures=5000)
+    bf = cv2.BFMatcher()
+
+    kp1, des1 = sift.detectAndCompute(img1, None)
+    img2 = shared_loader.load(os.path.join(images_folder_path, best_match), gray=True)
+    kp2, des2 = sift.detectAndCompute(img2, None)
+    matches = bf.knnMatch(des1, des2, k=2)
+    good = []
+    for m, n in matches:
+        if m.distance < 0.8 * n.distance:
+            good.append([m])
+    plot_knn_matches(img1, kp1, img2, kp2, good, title='Correspondances')
+
+
+def run_realtime(query_image_paths, images_folder_path, budget_ms, log=print):
+    """Match a stream of queries while a controller keeps each one inside budget_ms."""
+    references = len([f for f in os.listdir(images_folder_path) if f.endswith('.png')])
+    controller = LatencyController(budget_ms, references=references, log=log)
+    recent = []
+    for query_image_path in query_image_paths:
+        timer = StageTimer()
+        start = time.perf_counter()
+        result = find_best_match(query_image_path, images_folder_path, controller.settings, timer, recent)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"{query_image_path}: {result} en {elapsed:.0f} ms")
+        # Recent winners stay in the evaluated set when references are cut
+        if result and result[0]:
+            recent = [result[0]] + [r for r in recent if r != result[0]][:9]
+        controller.observe(timer.timings)
+    return controller
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        parser = argparse.ArgumentParser(description="Match queries inside a latency budget.")
+        parser.add_argument("queries", nargs="+")
+        parser.add_argument("--images", default="images")
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument("--budget-ms", type=float, help="per-query latency budget")
+        target.add_argument("--fps", type=float, help="target queries per second")
+        args = parser.parse_args()
+        run_realtime(args.queries, args.images, args.budget_ms or 1000.0 / args.fps)
+    else:
+        best_match, _ = find_best_match('inputs/image3.png', 'images')
+        if best_match:
+            show_best_match('inputs/image3.png', 'images', best_match)
@@ -1,103 +1,206 @@
 import cv2
 import os
-import matplotlib.pyplot as plt
 import numpy as np
 
 
-def find_best_match(input_image_path, repo_path, min_matches=10, ratio_thresh=0.7):
-    # Read image in color for visualization
-    img_input_color = cv2.imread(input_image_path)
-    if img_input_color is None:
-        raise FileNotFoundError(f"Input image {input_image_path} not found.")
-
-    # Convert to grayscale for SIFT
-    img_input = cv2.cvtColor(img_input_color, cv2.COLOR_BGR2GRAY)
-
-    # Get the base filename of the input image
-    input_filename = os.path.basename(input_image_path)
-
-    sift = cv2.SIFT_create()
-    kp_input, descriptors_input = sift.detectAndCompute(img_input, None)
-
-    bf = cv2.BFMatcher()
-    best_match = None
-    max_matches = 0
-    best_matches = None
-    best_kp = None
-    best_img = None
+from image_loader import shared_loader
+from reference_index import ReferenceIndex
+from sign_regions import classify_signs, sign_mask
+from tiled_extraction import TiledExtractor
 
-    for file_name in os.listdir(repo_path):
-        # Skip if it's not an image file
-        if not file_name.lower().endswith((".png", ".jpg", ".jpeg")):
-            continue
-
-        # Skip if it's the same image as input
-        if file_name == input_filename:
-            continue
 
-        # Read repo image in color
-        img_repo_color = cv2.imread(os.path.join(repo_path, file_name))
-        if img_repo_color is None:
+def ratio_test(matches, ratio=0.75):
+    good_matches = []
+    for match_group in matches:
+        if len(match_group) < 2:
             continue
-
-        # Convert to grayscale for SIFT
-        img_repo = cv2.cvtColor(img_repo_color, cv2.COLOR_BGR2GRAY)
-
-        kp_repo, descriptors_repo = sift.detectAndCompute(img_repo, None)
-        if descriptors_repo is None:
+        m, n = match_group
+        if m.distance < ratio * n.distance:
+            good_matches.append([m])
+    return good_matches
+
+
+def cluster_score(kp_repo, good_matches, repo_shape):
+    # Get matched points coordinates in the repo image
+    dst_pts = np.float32([kp_repo[match[0].trainIdx].pt for match in good_matches])
+    return cluster_score_points(dst_pts, repo_shape)
+
+
+def cluster_score_points(dst_pts, repo_shape):
+    # Calculate the center of matched points
+    center_dst = np.mean(dst_pts, axis=0)
+
+    # Calculate distances from each point to the center
+    distances = np.linalg.norm(dst_pts - center_dst, axis=1)
+
+    # Define a radius threshold (adjust this value based on your images)
+    radius_threshold = min(repo_shape) * 0.2  # 20% of smaller image dimension
+
+    # Count points within the radius
+    points_within_radius = np.sum(distances < radius_threshold)
+
+    # Calculate clustering ratio
+    clustering_ratio = points_within_radius / len(distances)
+
+    # Calculate final score combining number of matches and clustering
+    score = len(dst_pts) * clustering_ratio
+    return score, clustering_ratio
+
+
+def stack_queries(queries, dtype=None):
+    """Descriptors of several (descriptors, exclude) queries as one array.
+
+    Returns (stacked, offsets) where offsets[q] is the first row of query q.
+    Queries without descriptors take no rows; stacked is None when no query
+    has any.
+    """
+    offsets = []
+    blocks = []
+    total = 0
+    for descriptors_input, _ in queries:
+        offsets.append(total)
+        if descriptors_input is not None:
+            blocks.append(descriptors_input if dtype is None else np.asarray(descriptors_input, dtype=dtype))
+            total += len(descriptors_input)
+    return (np.vstack(blocks) if blocks else None), offsets
+
+
+def result_record(result):
+    """JSON-friendly summary of one (best_match, score, best_kp, best_matches) result."""
+    best_match, score, _, best_matches = result
+    return {
+        "best_match": best_match,
+        "score": float(score),
+        "matches": len(best_matches) if best_matches else 0,
+    }
+
+
+def match_batch(index, queries, min_matches=10, bf=None, verbose=False, runner_up=None):
+    """Match several queries against every reference of an index.
+
+    queries is a list of (descriptors, exclude_file_name) pairs. The query
+    descriptors are stacked so each reference costs one knnMatch call for the
+    whole batch; kNN rows are independent, so results equal per-query calls.
+    Returns one (best_match, score, best_kp, best_matches) tuple per query.
+    A runner_up list, one slot per query, receives the second-best score.
+    """
+    bf = bf if bf is not None else cv2.BFMatcher()
+    results = [(None, 0, None, None) for _ in queries]
+
+    stacked, offsets = stack_queries(queries)
+    if stacked is None:
+        return results
+
+    for entry in index:
+        matches = bf.knnMatch(stacked, entry.descriptors, k=2)
+
+        for q, (descriptors_input, exclude) in enumerate(queries):
+            # Skip if it's the same image as input
+            if descriptors_input is None or entry.file_name == exclude:
+                continue
+
+            offset = offsets[q]
+            good_matches = ratio_test(matches[offset:offset + len(descriptors_input)])
+            if len(good_matches) < min_matches:
+                continue
+            for match in good_matches:
+                match[0].queryIdx -= offset
+
+            score, clustering_ratio = cluster_score(
+                entry.keypoints, good_matches, entry.shape
+            )
+            if verbose:
+                print(
+                    f"{entry.file_name}: {len(good_matches)} matches, clustering ratio: {clustering_ratio:.2f}, score: {score:.2f}"
+                )
+
+            if clustering_ratio <= 0.6:  # Add minimum clustering threshold
+                continue
+            if score > results[q][1]:
+                if runner_up is not None:
+                    runner_up[q] = results[q][1]
+                results[q] = (entry.file_name, score, entry.keypoints, good_matches)
+            elif runner_up is not None and score > runner_up[q]:
+                runner_up[q] = score
+
+    return results
+
+
+def query_route(img_input_color):
+    """(shape, colour) of the largest sign in the query, or None if none found."""
+    signs = classify_signs(img_input_color, limit=1)
+    return signs[0] if signs else None
+
+
+def match_routed(index, queries, routes, min_matches=10, bf=None, margin=2.0, verbose=False,
+                 match_fn=None):
+    """match_batch restricted to each query's shape/colour partition.
+
+    Queries sharing a route are matched together against their partition;
+    queries without a route search the whole index. The partition's answer
+    is only trusted when it clearly stands out: its score is at least
+    `margin` times the partition's runner-up score (and times min_matches,
+    for a lone candidate). Otherwise the references outside the partition
+    are searched as well and the better answer is kept. A lower margin
+    skips more of the library but returns more answers a full scan would
+    not; margin=None always searches everything, only in another order.
+    match_fn(entries, queries, runner_up) replaces match_batch, e.g. with
+    GemmMatcher.
+    """
+    bf = bf if bf is not None else cv2.BFMatcher()
+    if match_fn is None:
+        def match_fn(entries, subset, runner_up):
+            return match_batch(entries, subset, min_matches, bf, verbose, runner_up)
+    results = [None] * len(queries)
+
+    groups = {}
+    for q, route in enumerate(routes):
+        groups.setdefault(route, []).append(q)
+
+    for route, members in groups.items():
+        candidates = list(index) if route is None else index.partition(*route)
+        runner_up = [0.0] * len(members)
+        group_results = match_fn(candidates, [queries[q] for q in members], runner_up)
+        for q, result in zip(members, group_results):
+            results[q] = result
+
+        if route is None:
             continue
-
-        matches = bf.knnMatch(descriptors_input, descriptors_repo, k=2)
-        good_matches = []
-
-        # Filter matches using ratio test
-        for m, n in matches:
-            if m.distance < 0.75 * n.distance:
-                good_matches.append([m])
-
-        if len(good_matches) < min_matches:
+        low = [
+            q for q, second in zip(members, runner_up)
+            if margin is None or results[q][1] < margin * max(second, min_matches)
+        ]
+        if not low:
             continue
+        scanned = {entry.file_name for entry in candidates}
+        rest = [entry for entry in index if entry.file_name not in scanned]
+        rest_results = match_fn(rest, [queries[q] for q in low], [0.0] * len(low))
+        for q, result in zip(low, rest_results):
+            if result[1] > results[q][1]:
+                results[q] = result
 
-        good_matches_flat = [match[0] for match in good_matches]
+    return results
 
-        # Get matched points coordinates
-        src_pts = np.float32(
-            [kp_input[m.queryIdx].pt for m in good_matches_flat]
-        ).reshape(-1, 1, 2)
-        dst_pts = np.float32(
-            [kp_repo[m.trainIdx].pt for m in good_matches_flat]
-        ).reshape(-1, 1, 2)
 
-        # Calculate the center of matched points
-        center_dst = np.mean(dst_pts.reshape(-1, 2), axis=0)
+def best_match_in_index(index, img_input_color, exclude=None, min_matches=10, verbose=False,
+                        mask=None, route=False):
+    # mask restricts the query keypoints, "auto" uses the detected sign outlines
+    if isinstance(mask, str) and mask == "auto":
+        mask = sign_mask(img_input_color)
 
-        # Calculate distances from each point to the center
-        distances = np.linalg.norm(dst_pts.reshape(-1, 2) - center_dst, axis=1)
-
-        # Define a radius threshold (adjust this value based on your images)
-        radius_threshold = min(img_repo.shape) * 0.2  # 20% of smaller image dimension
-
-        # Count points within the radius
-        points_within_radius = np.sum(distances < radius_threshold)
-
-        # Calculate clustering ratio
-        clustering_ratio = points_within_radius / len(distances)
-
-        # Calculate final score combining number of matches and clustering
-        score = len(good_matches) * clustering_ratio
-
-        print(
-            f"{file_name}: {len(good_matches)} matches, clustering ratio: {clustering_ratio:.2f}, score: {score:.2f}"
-        )
+    img_input = cv2.cvtColor(img_input_color, cv2.COLOR_BGR2GRAY)
+    kp_input, descriptors_input = index.sift.detectAndCompute(img_input, mask)
 
-        if (
-            score > max_matches and clustering_ratio > 0.6
-        ):  # Add minimum clustering threshold
-            max_matches = score
-            best_match = file_name
-            best_matches = good_matches
-            best_kp = kp_repo
-            best_img = img_repo_color
+    if route:
+        best_match, max_matches, best_kp, best_matches = match_routed(
+            index, [(descriptors_input, exclude)], [query_route(img_input_color)], min_matches,
+            verbose=verbose,
+        )[0]
+    else:
+        best_match, max_matches, best_kp, best_matches = match_batch(
+            index, [(descriptors_input, exclude)], min_matches, verbose=verbose
+        )[0]
+    best_img = index.load_color(best_match) if best_match else None
 
     return (
         best_match,
@@ -110,6 +213,27 @@ def find_best_match(input_image_path, repo_path, min_matches=10, ratio_thresh=0.
     )
 
 
+def find_best_match(input_image_path, repo_path, min_matches=10, ratio_thresh=0.7, tiled=False,
+                    mask=None, masked_references=False, budget=None, route=False):
+    # Read image in color for visualization
+    img_input_color = shared_loader.load(input_image_path)
+    if img_input_color is None:
+        raise FileNotFoundError(f"Input image {input_image_path} not found.")
+
+    # Tiled extraction only kicks in for images larger than two tiles
+    sift = TiledExtractor() if tiled else None
+    index = ReferenceIndex(repo_path, sift=sift, masked=masked_references, budget=budget).build()
+    return best_match_in_index(
+        index,
+        img_input_color,
+        exclude=os.path.basename(input_image_path),
+        min_matches=min_matches,
+        verbose=True,
+        mask=mask,
+        route=route,
+    )
+
+
 if __name__ == "__main__":
 
     input_image = "input.png"
@@ -127,49 +251,8 @@ if __name__ == "__main__":
     print(f"Best match: {best_match} with {max_matches} matches")
 
     if best_match:
-        # Create figure with larger size
-        plt.figure(figsize=(15, 10))
-
-        # Draw matches
-        img_matches = cv2.drawMatchesKnn(
-            img_input_color,
-            kp_input,
-            img_best,
-            kp_best,
-            good_matches,
-            None,
-            flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS,
-        )
-
-        # Show matches (images will now be in color)
-        plt.subplot(211)
-        plt.imshow(
-            cv2.cvtColor(img_matches, cv2.COLOR_BGR2RGB)
-        )  # Convert BGR to RGB for matplotlib
-        plt.title("Keypoint Matches")
-        plt.axis("off")
-
-        # Show original images with keypoints (in color)
-        plt.subplot(223)
-        img_kp1 = cv2.drawKeypoints(
-            img_input_color,
-            kp_input,
-            None,
-            flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS,
-        )
-        plt.imshow(cv2.cvtColor(img_kp1, cv2.COLOR_BGR2RGB))
-        plt.title("Input Image Keypoints")
-        plt.axis("off")
-
-        plt.subplot(224)
-        img_kp2 = cv2.drawKeypoints(
-            img_best, kp_best, None, flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS
-        )
-        plt.imshow(cv2.cvtColor(img_kp2, cv2.COLOR_BGR2RGB))
-        plt.title("Best Match Keypoints")
-        plt.axis("off")
-
-        plt.tight_layout()
-        plt.show()
+        from visualize import plot_matches
+
+        plot_matches(img_input_color, kp_input, img_best, kp_best, good_matches)
     else:
         print("No match found.")
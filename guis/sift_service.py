@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from gemm_matching import GemmMatcher
+from image_loader import ImageLoader
+from reference_index import FEATURE_CACHE_DIR, ReferenceIndex
+from result_cache import ResultCache
+from sign_regions import sign_mask
+from sift2 import match_batch, match_routed, query_route, result_record
+
+
+class ServiceMetrics:
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.latencies = deque(maxlen=window)
+        self.completed_at = deque(maxlen=window)
+
+    def record_batch(self, size):
+        with self.lock:
+            self.batches += 1
+            self.batched_requests += size
+
+    def record_request(self, latency, ok=True):
+        with self.lock:
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+            self.latencies.append(latency)
+            self.completed_at.append(time.monotonic())
+
+    def snapshot(self):
+        with self.lock:
+            now = time.monotonic()
+            latencies = np.array(self.latencies) * 1000
+            recent = [t for t in self.completed_at if now - t <= 60]
+            window = min(60.0, now - self.started) or 1.0
+            snapshot = {
+                "uptime_s": round(now - self.started, 1),
+                "requests": self.requests,
+                "errors": self.errors,
+                "batches": self.batches,
+                "mean_batch_size": round(self.batched_requests / self.batches, 2)
+                if self.batches
+                else 0,
+                "throughput_rps": round(len(recent) / window, 2),
+            }
+            if len(latencies):
+                for p in (50, 95, 99):
+                    snapshot[f"latency_p{p}_ms"] = round(float(np.percentile(latencies, p)), 2)
+            return snapshot
+
+
+class MicroBatcher:
+    """Groups concurrent requests so they share one pass over the references.
+
+    A single worker thread owns the warm SIFT/BFMatcher objects. It waits for
+    the first request, then keeps collecting for up to max_wait_ms (or until
+    max_batch requests are pending) before matching the whole batch.
+    """
+
+    def __init__(self, index, max_batch=8, max_wait_ms=10, min_matches=10, metrics=None,
+                 mask_queries=False, route=False, engine="bf"):
+        self.index = index
+        self.mask_queries = mask_queries
+        self.route = route
+        # "gemm" matches whole batches with BLAS, same results as "bf"
+        self.gemm = GemmMatcher(index) if engine == "gemm" else None
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.min_matches = min_matches
+        self.metrics = metrics or ServiceMetrics()
+        self.bf = cv2.BFMatcher()
+        self.pending = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, img_input_color):
+        future = Future()
+        self.pending.put((img_input_color, future))
+        return future
+
+    def _collect(self):
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self.metrics.record_batch(len(batch))
+            try:
+                queries = []
+                routes = []
+                for img_input_color, _ in batch:
+                    img_input = cv2.cvtColor(img_input_color, cv2.COLOR_BGR2GRAY)
+                    mask = sign_mask(img_input_color) if self.mask_queries else None
+                    _, descriptors_input = self.index.sift.detectAndCompute(img_input, mask)
+                    queries.append((descriptors_input, None))
+                    routes.append(query_route(img_input_color) if self.route else None)
+
+                results = self._match(queries, routes)
+                for (_, future), result in zip(batch, results):
+                    record = result_record(result)
+                    record["batch_size"] = len(batch)
+                    future.set_result(record)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+    def _match(self, queries, routes):
+        match_fn = None
+        if self.gemm is not None:
+            def match_fn(entries, subset, runner_up=None):
+                return self.gemm.match(subset, self.min_matches, entries, runner_up=runner_up)
+
+        if self.route:
+            return match_routed(
+                self.index, queries, routes, self.min_matches, bf=self.bf, match_fn=match_fn
+            )
+        if match_fn is not None:
+            return match_fn(self.index, queries)
+        return match_batch(self.index, queries, self.min_matches, bf=self.bf)
+
+
+class RecognitionHandler(BaseHTTPRequestHandler):
+    batcher = None
+    cache = None
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            snapshot = self.batcher.metrics.snapshot()
+            snapshot["references"] = len(self.batcher.index)
+            snapshot["partitions"] = self.batcher.index.partition_sizes()
+            if self.cache is not None:
+                snapshot["cache"] = self.cache.stats()
+            self._send_json(200, snapshot)
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/match":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        start = time.monotonic()
+        length = int(self.headers.get("Content-Length", 0))
+        data = np.frombuffer(self.rfile.read(length), dtype=np.uint8)
+        img_input_color = cv2.imdecode(data, cv2.IMREAD_COLOR) if length else None
+        if img_input_color is None:
+            self.batcher.metrics.record_request(time.monotonic() - start, ok=False)
+            self._send_json(400, {"error": "body is not a decodable image"})
+            return
+
+        key = self.cache.key(img_input_color) if self.cache is not None else None
+        cached = self.cache.get(key) if key is not None else None
+        if cached is not None:
+            result = dict(cached, cached=True)
+        else:
+            try:
+                result = self.batcher.submit(img_input_color).result()
+            except Exception as e:
+                self.batcher.metrics.record_request(time.monotonic() - start, ok=False)
+                self._send_json(500, {"error": str(e)})
+                return
+            if key is not None:
+                self.cache.put(key, dict(result))
+
+        latency = time.monotonic() - start
+        self.batcher.metrics.record_request(latency)
+        result["latency_ms"] = round(latency * 1000, 2)
+        self._send_json(200, result)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(repo_path, port=8765, max_batch=8, max_wait_ms=10, min_matches=10, cache=None,
+          masked=False, budget=None, route=False, engine="bf"):
+    # A long-running process: prefetch references, but do not keep them decoded
+    index = ReferenceIndex(
+        repo_path,
+        cache_dir=os.path.join(repo_path, FEATURE_CACHE_DIR),
+        masked=masked,
+        budget=budget,
+        loader=ImageLoader(max_mb=0),
+    ).build()
+    print(f"Indexed {len(index)} reference images from {repo_path}")
+
+    RecognitionHandler.batcher = MicroBatcher(
+        index, max_batch, max_wait_ms, min_matches, mask_queries=masked, route=route, engine=engine
+    )
+    RecognitionHandler.cache = cache
+    # Bound to the loopback interface only, this is not meant to be exposed
+    server = ThreadingHTTPServer(("127.0.0.1", port), RecognitionHandler)
+    print(f"Listening on http://127.0.0.1:{server.server_address[1]}")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local traffic sign recognition service.")
+    parser.add_argument("--repo", default="images/")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--min-matches", type=int, default=10)
+    parser.add_argument("--cache-size", type=int, default=256, help="0 disables the result cache")
+    parser.add_argument("--cache-ttl", type=float, default=300)
+    parser.add_argument(
+        "--cache-distance", type=int, default=4, help="max Hamming distance between hashes"
+    )
+    parser.add_argument(
+        "--mask", action="store_true", help="extract features inside detected sign outlines only"
+    )
+    parser.add_argument("--budget", type=int, help="max keypoints kept per reference")
+    parser.add_argument(
+        "--route",
+        action="store_true",
+        help="search references of the query's sign shape first, and the rest unless the "
+        "best score there is at least twice the runner-up's (and twice --min-matches)",
+    )
+    parser.add_argument(
+        "--engine", choices=("bf", "gemm"), default="bf", help="descriptor matching engine"
+    )
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache_size > 0:
+        cache = ResultCache(args.cache_size, args.cache_ttl, args.cache_distance)
+
+    server = serve(
+        args.repo,
+        args.port,
+        args.max_batch,
+        args.max_wait_ms,
+        args.min_matches,
+        cache,
+        args.mask,
+        args.budget,
+        args.route,
+        args.engine,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,356 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from reference_index import FEATURE_CACHE_DIR, ReferenceIndex
+from result_cache import ResultCache, cached_match, dhash
+from multi_sign import hough_clusters, pose_arrays, predict_poses
+from sift2 import match_batch, match_routed, query_route, result_record
+from sign_regions import find_sign_contours, roi_bounds, sign_mask
+from tiled_extraction import TiledExtractor
+
+# Marks the end of a frame stream between threads
+END = None
+
+
+def put_until(items, item, stop):
+    # A plain put() would block forever once the consumer is gone
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def read_frames(capture, frames, stop, next_wanted=None):
+    """Queue (index, frame) pairs, then END.
+
+    With next_wanted, frames before the index it returns are only grabbed,
+    not decoded, and queued as (index, None).
+    """
+    index = 0
+    while True:
+        if next_wanted is not None and index < next_wanted():
+            suc, frame = capture.grab(), None
+        else:
+            suc, frame = capture.read()
+        if not suc or not put_until(frames, (index, frame), stop):
+            break
+        index += 1
+    put_until(frames, END, stop)
+
+
+def write_frames(writer, annotated):
+    while True:
+        frame = annotated.get()
+        if frame is END:
+            break
+        writer.write(frame)
+
+
+def frame_key(frame, grid=16, hash_size=16):
+    """Result cache key of a frame, None when no sign outline is found.
+
+    Every detected sign crop contributes its position (in grid cells) and
+    its own hash, so a sign that appears, moves or changes gives a new key
+    even where it barely moves the hash of the whole frame. The exact
+    whole-frame hash guards against signs the contour detector misses.
+    """
+    found = find_sign_contours(frame)
+    if not found:
+        return None
+    crops = []
+    for _, contour in found:
+        x1, y1, x2, y2 = roi_bounds(frame, contour)
+        crops.append((x1 // grid, y1 // grid, x2 // grid, y2 // grid, dhash(frame[y1:y2, x1:x2])))
+    return dhash(frame, hash_size), tuple(sorted(crops))
+
+
+def match_bbox(kp_frame, result, min_votes=4, ransac_threshold=0.1):
+    """[x, y, w, h] of the best match's largest pose cluster, or None.
+
+    The matches vote for a pose of the reference and the largest cluster is
+    verified with a similarity fit, as in MultiSignDetector; the matched
+    part of the reference is carried into the frame through that fit, so
+    stray matches elsewhere in the frame do not stretch the box.
+    """
+    _, _, kp_ref, best_matches = result
+    query_idx = np.array([m[0].queryIdx for m in best_matches])
+    train_idx = np.array([m[0].trainIdx for m in best_matches])
+    scene, reference = pose_arrays(kp_frame), pose_arrays(kp_ref)
+    low, high = reference[0].min(axis=0), reference[0].max(axis=0)
+    extent = float(max(high - low)) or 1.0
+
+    x, y, log_scale, angle = predict_poses(scene, reference, query_idx, train_idx, (low + high) / 2)
+    clusters = hough_clusters(x, y, log_scale, angle, extent, min_votes)
+    if not clusters:
+        return None
+    members = np.array(clusters[0])
+    scale = float(2.0 ** np.median(log_scale[members]))
+
+    src = reference[0][train_idx[members]]
+    dst = scene[0][query_idx[members]]
+    matrix, inliers = cv2.estimateAffinePartial2D(
+        src, dst, method=cv2.RANSAC, ransacReprojThreshold=max(2.0, ransac_threshold * extent * scale)
+    )
+    if matrix is None:
+        return None
+    inliers = inliers.ravel().astype(bool)
+    if inliers.sum() < min_votes:
+        return None
+
+    x1, y1 = src[inliers].min(axis=0)
+    x2, y2 = src[inliers].max(axis=0)
+    corners = np.float32([[x1, y1], [x2, y1], [x2, y2], [x1, y2]]) @ matrix[:, :2].T + matrix[:, 2]
+    bx1, by1 = corners.min(axis=0)
+    bx2, by2 = corners.max(axis=0)
+    return [int(bx1), int(by1), int(np.ceil(bx2 - bx1)), int(np.ceil(by2 - by1))]
+
+
+def recognize_frame(index, extractor, frame, min_matches=10, masked=False, route=False,
+                    cache=None):
+    if cache is not None:
+        # A frame with the same sign crops as a recent one reuses its result
+        return cached_match(
+            cache,
+            frame,
+            lambda f: recognize_frame(index, extractor, f, min_matches, masked, route),
+        )
+
+    frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    mask = sign_mask(frame) if masked else None
+    kp_frame, descriptors_frame = extractor.detectAndCompute(frame_gray, mask)
+    if route:
+        result = match_routed(index, [(descriptors_frame, None)], [query_route(frame)], min_matches)[0]
+    else:
+        result = match_batch(index, [(descriptors_frame, None)], min_matches)[0]
+
+    record = result_record(result)
+    record["bbox"] = match_bbox(kp_frame, result) if record["best_match"] else None
+    return record
+
+
+def annotate(frame, result):
+    if result and result["best_match"] and result["bbox"]:
+        x, y, w, h = result["bbox"]
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        cv2.putText(
+            frame,
+            f"{result['best_match']} ({result['score']:.0f})",
+            (x, max(20, y - 8)),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.7,
+            (0, 255, 0),
+            2,
+        )
+    return frame
+
+
+def process_video(input_path, output_path, log_path, index, every=5, adaptive=False,
+                  max_stride=30, min_matches=10, queue_size=64, masked=False, route=False,
+                  speed=1.0, cache_size=0, cache_frames=None):
+    """Recognize signs in a recorded video without any display.
+
+    Frames are decoded on a reader thread and encoded on a writer thread, so
+    the main thread only does recognition; without output_path the reader
+    skips decoding frames that will not be matched. Every `every`-th frame is matched;
+    with adaptive=True the stride follows a throughput target instead: the
+    video time covered per second of wall time between two matched frames
+    is kept at `speed` (1.0 keeps up with real time). The stride grows
+    while processing falls short of the target and shrinks back, never
+    below `every`, once it is comfortably ahead. Frames in
+    between reuse the last result for annotation. Each matched frame is
+    logged as one JSON line. With cache_size, a matched frame whose sign
+    crops (see frame_key) are identical to those of a frame matched at most
+    cache_frames frames earlier reuses that frame's result.
+    """
+    capture = cv2.VideoCapture(input_path)
+    if not capture.isOpened():
+        raise FileNotFoundError(f"Video {input_path} could not be opened.")
+
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    frames = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    # Without an output video only matched frames need decoding; the reader
+    # reads next_frame as the loop below moves it
+    next_wanted = None if output_path else (lambda: next_frame)
+    reader = threading.Thread(
+        target=read_frames, args=(capture, frames, stop, next_wanted), daemon=True
+    )
+
+    writer = None
+    annotated = None
+    if output_path:
+        video_writer = cv2.VideoWriter(
+            output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height)
+        )
+        annotated = queue.Queue(maxsize=queue_size)
+        writer = threading.Thread(target=write_frames, args=(video_writer, annotated), daemon=True)
+        writer.start()
+
+    extractor = TiledExtractor()
+    cache = None
+    if cache_size:
+        # Exact keys only, aged in frames: the clock reads the loop's frame_index
+        cache = ResultCache(
+            cache_size,
+            ttl=cache_frames,
+            max_distance=0,
+            key_fn=frame_key,
+            clock=lambda: frame_index,
+        )
+    frame_index = 0
+    stride = every
+    next_frame = 0
+    last_result = None
+    seen = 0
+    processed = 0
+    start = time.monotonic()
+    # Frame index and time of the last matched frame
+    last_index = last_time = None
+    reader.start()
+
+    try:
+        with open(log_path, "w") as log:
+            while True:
+                item = frames.get()
+                if item is END:
+                    break
+                frame_index, frame = item
+                seen += 1
+
+                if frame is not None and frame_index >= next_frame:
+                    last_result = recognize_frame(
+                        index, extractor, frame, min_matches, masked, route, cache
+                    )
+                    processed += 1
+                    record = {
+                        "frame": frame_index,
+                        "time_s": round(frame_index / fps, 3),
+                        "stride": stride,
+                    }
+                    record.update(last_result)
+                    log.write(json.dumps(record) + "\n")
+
+                    if adaptive:
+                        now = time.monotonic()
+                        if last_index is not None:
+                            # Video seconds covered per wall second since the last match
+                            rate = (frame_index - last_index) / fps / max(now - last_time, 1e-6)
+                            # Move half way (geometrically) to the stride that
+                            # would have met the target over that window
+                            wanted = stride * (speed / max(rate, 1e-6)) ** 0.5
+                            if wanted > 1.05 * stride or wanted < stride / 1.25:
+                                stride = min(max_stride, max(every, round(wanted)))
+                        last_index, last_time = frame_index, now
+                    next_frame = frame_index + stride
+
+                if annotated is not None:
+                    annotated.put(annotate(frame, last_result))
+    finally:
+        # Always stop the reader and finish the output file, also on errors
+        stop.set()
+        reader.join()
+        capture.release()
+        if annotated is not None:
+            annotated.put(END)
+            writer.join()
+            video_writer.release()
+
+    elapsed = time.monotonic() - start
+    report = {
+        "frames": seen,
+        "processed": processed,
+        "seconds": round(elapsed, 2),
+        "fps": round(seen / elapsed, 2) if elapsed else 0.0,
+        "recognition_fps": round(processed / elapsed, 2) if elapsed else 0.0,
+        "final_stride": stride,
+        "speed": round(seen / fps / elapsed, 2) if elapsed else 0.0,
+    }
+    if cache is not None:
+        report["cache"] = cache.stats()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recognize traffic signs in a recorded video.")
+    parser.add_argument("video")
+    parser.add_argument("--repo", default="images/")
+    parser.add_argument("--output", help="annotated video to write (mp4)")
+    parser.add_argument("--log", help="JSONL detection log (default: <video>.jsonl)")
+    parser.add_argument("--every", type=int, default=5, help="match every Nth frame")
+    parser.add_argument(
+        "--adaptive", action="store_true", help="adjust the stride to keep up with --speed"
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="video seconds to process per wall second with --adaptive (1.0 = real time)",
+    )
+    parser.add_argument("--max-stride", type=int, default=30)
+    parser.add_argument("--min-matches", type=int, default=10)
+    parser.add_argument(
+        "--mask", action="store_true", help="extract features inside detected sign outlines only"
+    )
+    parser.add_argument("--budget", type=int, help="max keypoints kept per reference")
+    parser.add_argument(
+        "--route",
+        action="store_true",
+        help="search references of the frame's sign shape first, and the rest unless the "
+        "best score there is at least twice the runner-up's (and twice --min-matches)",
+    )
+    parser.add_argument(
+        "--cache",
+        type=int,
+        default=0,
+        metavar="SIZE",
+        help="reuse the result of a recent frame with identical sign crops, "
+        "keeping SIZE results (0: off)",
+    )
+    parser.add_argument(
+        "--cache-frames", type=int, default=30, help="how many frames a cached result stays valid"
+    )
+    args = parser.parse_args()
+
+    index = ReferenceIndex(
+        args.repo,
+        cache_dir=os.path.join(args.repo, FEATURE_CACHE_DIR),
+        masked=args.mask,
+        budget=args.budget,
+    ).build()
+    log_path = args.log or os.path.splitext(args.video)[0] + ".jsonl"
+
+    report = process_video(
+        args.video,
+        args.output,
+        log_path,
+        index,
+        every=args.every,
+        adaptive=args.adaptive,
+        max_stride=args.max_stride,
+        min_matches=args.min_matches,
+        masked=args.mask,
+        route=args.route,
+        speed=args.speed,
+        cache_size=args.cache,
+        cache_frames=args.cache_frames,
+    )
+    print(
+        f"{report['frames']} frames in {report['seconds']} s: {report['fps']} fps "
+        f"({report['speed']}x real time), "
+        f"{report['processed']} matched ({report['recognition_fps']} fps, final stride {report['final_stride']})"
+    )
+    if "cache" in report:
+        print(f"cache: {report['cache']['hits']} hits, {report['cache']['misses']} misses")
@@ -0,0 +1,124 @@
+import cv2
+import numpy as np
+
+TRIANGLE = "triangle"
+OCTAGON = "octagon"
+CIRCLE = "circle"
+
+
+def find_sign_contours(image, min_area=300):
+    """Candidate sign outlines in a BGR image, as (shape, contour) pairs.
+
+    Triangles have 3 polygon vertices, octagons 8, and anything else with a
+    circularity between 0.8 and 1.2 counts as a circle.
+    """
+    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+    blurred_image = cv2.GaussianBlur(gray_image, (7, 7), 0)
+
+    low_threshold = 10
+    high_threshold = 50
+    edges = cv2.Canny(blurred_image, low_threshold, high_threshold)
+
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    found = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area < min_area:
+            continue
+
+        epsilon = 0.04 * cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, epsilon, True)
+
+        if len(approx) == 3:
+            found.append((TRIANGLE, contour))
+            continue
+        if len(approx) == 8:
+            found.append((OCTAGON, contour))
+            continue
+
+        perimeter = cv2.arcLength(contour, True)
+        if perimeter != 0:
+            circularity = 4 * np.pi * area / (perimeter ** 2)
+            if 0.8 < circularity < 1.2:
+                found.append((CIRCLE, contour))
+
+    return found
+
+
+def roi_bounds(image, contour, padding=10):
+    x, y, w, h = cv2.boundingRect(contour)
+    y1, y2 = max(0, y - padding), min(image.shape[0], y + h + padding)
+    x1, x2 = max(0, x - padding), min(image.shape[1], x + w + padding)
+    return x1, y1, x2, y2
+
+
+def contours_mask(shape, contours, padding=10):
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+    cv2.drawContours(mask, contours, -1, 255, thickness=cv2.FILLED)
+    if padding:
+        # Grow the region so keypoints on the sign border keep their support
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * padding + 1, 2 * padding + 1))
+        mask = cv2.dilate(mask, kernel)
+    return mask
+
+
+def rect_mask(shape, rect):
+    x, y, w, h = (int(v) for v in rect)
+    mask = np.zeros(shape[:2], dtype=np.uint8)
+    mask[max(0, y):y + h, max(0, x):x + w] = 255
+    return mask
+
+
+def sign_mask(image, padding=10, min_area=300):
+    """Foreground mask covering every detected sign, or None if none found.
+
+    None means "no restriction" for detectAndCompute, so images where the
+    contour detector finds nothing keep their full set of keypoints.
+    """
+    found = find_sign_contours(image, min_area)
+    if not found:
+        return None
+    return contours_mask(image.shape, [contour for _, contour in found], padding)
+
+
+# Hue ranges on OpenCV's 0-179 scale
+COLOUR_HUES = {
+    "red": [(0, 10), (160, 180)],
+    "yellow": [(15, 35)],
+    "blue": [(90, 130)],
+}
+
+
+def dominant_colour(image, mask, min_saturated=0.15, hsv=None):
+    """Main sign colour inside mask: red, yellow, blue, or white if unsaturated."""
+    if hsv is None:
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    inside = mask > 0
+    hue = hsv[..., 0][inside]
+    saturated = (hsv[..., 1][inside] > 80) & (hsv[..., 2][inside] > 50)
+    if not inside.any() or saturated.mean() < min_saturated:
+        return "white"
+
+    hue = hue[saturated]
+    counts = {
+        colour: sum(int(np.count_nonzero((hue >= lo) & (hue < hi))) for lo, hi in ranges)
+        for colour, ranges in COLOUR_HUES.items()
+    }
+    colour = max(counts, key=counts.get)
+    return colour if counts[colour] else "white"
+
+
+def classify_signs(image, found=None, limit=3):
+    """Shape and colour of the `limit` largest detected signs, largest first."""
+    if image.ndim != 3:
+        return []
+    if found is None:
+        found = find_sign_contours(image)
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    signs = []
+    for shape, contour in sorted(found, key=lambda f: cv2.contourArea(f[1]), reverse=True)[:limit]:
+        mask = contours_mask(image.shape, [contour], padding=0)
+        signs.append((shape, dominant_colour(image, mask, hsv=hsv)))
+    return signs
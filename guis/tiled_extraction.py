@@ -0,0 +1,108 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+class TiledExtractor:
+    """Drop-in replacement for a SIFT object that extracts tile by tile.
+
+    Large images are split into tiles that overlap by `overlap` pixels and
+    each tile is run through detectAndCompute on a thread pool (OpenCV
+    releases the GIL, so the tiles really run in parallel). Every tile owns a
+    non-overlapping core region; only keypoints falling inside their tile's
+    core are kept, which removes the duplicates from the overlap while still
+    giving every kept keypoint `overlap` pixels of context for its descriptor.
+
+    Keep tile_size well above the size of the signs you expect, features
+    larger than a tile cannot be found.
+    """
+
+    def __init__(self, sift_factory=cv2.SIFT_create, tile_size=512, overlap=64,
+                 workers=None, nfeatures=0, min_size=None):
+        self.sift_factory = sift_factory
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.workers = workers or os.cpu_count() or 1
+        self.nfeatures = nfeatures
+        # Below this size tiling costs more than it saves
+        self.min_size = min_size if min_size is not None else 2 * tile_size
+        self.local = threading.local()
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def configure(self, sift_factory=None, nfeatures=None):
+        """Change the SIFT settings; every thread builds a new SIFT on its next tile.
+
+        nfeatures caps the whole image, tiled or not, so the factory should
+        not set one of its own: it would cap every tile as well.
+        """
+        if sift_factory is not None:
+            self.sift_factory = sift_factory
+        if nfeatures is not None:
+            self.nfeatures = nfeatures
+        self.local = threading.local()
+
+    def _sift(self):
+        # SIFT objects are not shared between threads
+        sift = getattr(self.local, "sift", None)
+        if sift is None:
+            sift = self.local.sift = self.sift_factory()
+        return sift
+
+    def tiles(self, height, width):
+        for y0 in range(0, height, self.tile_size):
+            for x0 in range(0, width, self.tile_size):
+                y1 = min(y0 + self.tile_size, height)
+                x1 = min(x0 + self.tile_size, width)
+                yield (x0, y0, x1, y1)
+
+    def _extract_tile(self, img, mask, core):
+        x0, y0, x1, y1 = core
+        height, width = img.shape[:2]
+        ty0, ty1 = max(0, y0 - self.overlap), min(height, y1 + self.overlap)
+        tx0, tx1 = max(0, x0 - self.overlap), min(width, x1 + self.overlap)
+
+        tile_mask = mask[ty0:ty1, tx0:tx1] if mask is not None else None
+        keypoints, descriptors = self._sift().detectAndCompute(img[ty0:ty1, tx0:tx1], tile_mask)
+        if descriptors is None:
+            return [], None
+
+        kept_keypoints = []
+        kept_rows = []
+        for row, kp in enumerate(keypoints):
+            x, y = kp.pt[0] + tx0, kp.pt[1] + ty0
+            if x0 <= x < x1 and y0 <= y < y1:
+                kp.pt = (x, y)
+                kept_keypoints.append(kp)
+                kept_rows.append(row)
+        return kept_keypoints, descriptors[kept_rows]
+
+    def detectAndCompute(self, img, mask):
+        height, width = img.shape[:2]
+        if max(height, width) < self.min_size:
+            keypoints, descriptors = self._sift().detectAndCompute(img, mask)
+            if descriptors is None:
+                return keypoints, None
+        else:
+            results = self.pool.map(
+                lambda core: self._extract_tile(img, mask, core), list(self.tiles(height, width))
+            )
+
+            keypoints = []
+            blocks = []
+            for tile_keypoints, tile_descriptors in results:
+                if tile_keypoints:
+                    keypoints.extend(tile_keypoints)
+                    blocks.append(tile_descriptors)
+            if not blocks:
+                return (), None
+            descriptors = np.vstack(blocks)
+
+        if self.nfeatures and len(keypoints) > self.nfeatures:
+            # Same as SIFT's own nfeatures: keep the strongest responses
+            order = np.argsort([-kp.response for kp in keypoints])[: self.nfeatures]
+            keypoints = [keypoints[i] for i in order]
+            descriptors = descriptors[order]
+        return keypoints, descriptors
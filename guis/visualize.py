@@ -0,0 +1,65 @@
+import cv2
+
+# matplotlib is only needed for the demo windows, so it is imported inside the
+# functions below. Importing this module (or the matchers) stays cheap.
+
+
+def plot_matches(img_input_color, kp_input, img_best, kp_best, good_matches):
+    import matplotlib.pyplot as plt
+
+    # Create figure with larger size
+    plt.figure(figsize=(15, 10))
+
+    # Draw matches
+    img_matches = cv2.drawMatchesKnn(
+        img_input_color,
+        kp_input,
+        img_best,
+        kp_best,
+        good_matches,
+        None,
+        flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS,
+    )
+
+    # Show matches (images will now be in color)
+    plt.subplot(211)
+    plt.imshow(
+        cv2.cvtColor(img_matches, cv2.COLOR_BGR2RGB)
+    )  # Convert BGR to RGB for matplotlib
+    plt.title("Keypoint Matches")
+    plt.axis("off")
+
+    # Show original images with keypoints (in color)
+    plt.subplot(223)
+    img_kp1 = cv2.drawKeypoints(
+        img_input_color,
+        kp_input,
+        None,
+        flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS,
+    )
+    plt.imshow(cv2.cvtColor(img_kp1, cv2.COLOR_BGR2RGB))
+    plt.title("Input Image Keypoints")
+    plt.axis("off")
+
+    plt.subplot(224)
+    img_kp2 = cv2.drawKeypoints(
+        img_best, kp_best, None, flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS
+    )
+    plt.imshow(cv2.cvtColor(img_kp2, cv2.COLOR_BGR2RGB))
+    plt.title("Best Match Keypoints")
+    plt.axis("off")
+
+    plt.tight_layout()
+    plt.show()
+
+
+def plot_knn_matches(img1, kp1, img2, kp2, good, title="Correspondances"):
+    import matplotlib.pyplot as plt
+
+    img_matches = cv2.drawMatchesKnn(
+        img1, kp1, img2, kp2, good, None,
+        flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS,
+    )
+    plt.imshow(img_matches)
+    plt.title(title)
+    plt.show()
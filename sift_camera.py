@@ -1,38 +1,77 @@
-import cv2 
+import argparse
+import os
+import sys
 import time
 
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "guis"))
+from latency_control import LatencyController, Settings, StageTimer
+from tiled_extraction import TiledExtractor
+
+parser = argparse.ArgumentParser(description="Match camera frames against a template.")
+target = parser.add_mutually_exclusive_group()
+target.add_argument("--fps", type=float, help="adapt SIFT settings to reach this frame rate")
+target.add_argument("--budget-ms", type=float, help="adapt SIFT settings to this per-frame latency")
+args = parser.parse_args()
+
 sift = cv2.SIFT_create()
+# Frames of a megapixel and up (long side >= 1024) are extracted tile by
+# tile on all cores; a 640x480 webcam frame goes through a single SIFT
+frame_sift = TiledExtractor()
+
+controller = None
+settings = Settings(nfeatures=0)
+if args.fps or args.budget_ms:
+    # Start from the same settings as guis/sift.py and lower them as needed
+    settings = Settings()
+
+    def frame_sift_factory():
+        # nfeatures is left to the extractor, which caps the whole frame
+        # once; set here it would cap every tile as well
+        return cv2.SIFT_create(contrastThreshold=settings.contrast_threshold)
+
+    frame_sift.configure(frame_sift_factory, settings.nfeatures)
+    controller = LatencyController(args.budget_ms or 1000.0 / args.fps, settings=settings)
 
 bf = cv2.BFMatcher(cv2.NORM_L2, crossCheck=True)
 
 cap = cv2.VideoCapture(0)
 
-while cap.isOpened():
+# The template does not change between frames, extract it once
+img2 = cv2.imread('inputs/image1.png', 0)
+if img2 is None:
+    print("Image not found!")
+else:
+    keypoints_2, descriptors_2 = sift.detectAndCompute(img2, None)
+
+while img2 is not None and cap.isOpened():
     suc, img1 = cap.read()
     if not suc:
         break
 
-    img2 = cv2.imread('inputs/image1.png', 0)
-
-    if img2 is None:
-        print("Image not found!")
-        break
-
     start = time.time()
+    timer = StageTimer()
 
-    img1_gray = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
+    with timer.stage("extract"):
+        img1 = settings.resize(img1)
+        img1_gray = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
 
-    keypoints_1, descriptors_1 = sift.detectAndCompute(img1_gray, None)
-    keypoints_2, descriptors_2 = sift.detectAndCompute(img2, None)
+        keypoints_1, descriptors_1 = frame_sift.detectAndCompute(img1_gray, None)
 
-    matches = bf.match(descriptors_1, descriptors_2)
-    matches = sorted(matches, key=lambda x: x.distance)
+    with timer.stage("match"):
+        matches = bf.match(descriptors_1, descriptors_2) if descriptors_1 is not None else []
+        matches = sorted(matches, key=lambda x: x.distance)
 
     end = time.time()
     totalTime = end - start
 
     fps = 1 / totalTime
 
+    if controller is not None and controller.observe(timer.timings):
+        # Rebuilds the SIFTs with the new threshold and sets the new cap
+        frame_sift.configure(nfeatures=settings.nfeatures)
+
     img3 = cv2.drawMatches(img1, keypoints_1, img2, keypoints_2, matches[:300], img2, flags=2)
 
     cv2.putText(img3, f'FPS: {int(fps)}', (20, 450), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 0), 2)